@@ -1,103 +1,258 @@
 import os
 import torch
+from concurrent.futures import ThreadPoolExecutor
 from torch.utils.data import Dataset
 from torchvision import transforms
+from torchvision.io import read_file, decode_jpeg, ImageReadMode
 from PIL import Image
 import numpy as np
+from goal_batching import GoalTableMixin
 
-class SPOT_SingleStep_DataLoader(Dataset):
-    def __init__(self, dataset_dirs, transform=None):
-        self.transform = transform
+SCAN_THREADS = 16   # Trajectories stat'ed and scanned in parallel, mostly waiting on the file system
+GOAL_DECODE_BATCH = 64   # Goal images per decode_jpeg call when building the goal table
+BACKENDS = ('pil', 'torchvision')
+
+class SPOT_SingleStep_DataLoader(GoalTableMixin, Dataset):
+    LABEL_FILE = 'labels.npy'
+    LABEL_DTYPE = torch.float32
 
-        self.current_images_paths = []
-        self.labels = np.empty([0, 3])
-        self.goal_image_paths = []
+    def __init__(self, dataset_dirs, transform=None, feature_store=None, return_goal_index=False, unique_goals=False,
+                 index_cache=True, draft_size=None, backend='pil'):
+        # 'pil' decodes one image at a time and transform takes PIL images.
+        # 'torchvision' decodes all images of a step with one batched decode_jpeg call, and
+        # transform takes the stacked uint8 (N, 3, H, W) tensor, e.g. batch_transforms.tensor_uint8_transforms
+        if backend not in BACKENDS:
+            raise ValueError(f'Unknown backend {backend}, expected one of {BACKENDS}')
+        if draft_size is not None and backend == 'torchvision':
+            # decode_jpeg always decodes at full size
+            raise ValueError("draft_size needs the 'pil' backend, decode_jpeg has no reduced-scale decode")
+        self.backend = backend
+        self.transform = transform
+        # (W, H) the transform resizes to. JPEGs are then decoded at the smallest DCT scale
+        # (1/2, 1/4 or 1/8) still at least that large, and the transform does the rest
+        self.draft_size = draft_size
+        # DinoFeatureStore, serves precomputed DinoV2 patch tokens in place of images
+        self.feature_store = feature_store
+        self.init_goal_batching(return_goal_index, unique_goals)
+        # Keep a per dataset dir index cache, see index_dataset_dir
+        self.index_cache = index_cache
 
         if not isinstance(dataset_dirs, list):
             dataset_dirs = [dataset_dirs]
+        self.dataset_dirs = dataset_dirs
 
-        for dataset_dir in dataset_dirs:
-
-            trajectories = [item for item in os.listdir(dataset_dir) if item.startswith('traj_')]
-            trajectories = sorted(trajectories, key=lambda x: int(x[5:]))
-            for trajectory in trajectories:
-                traj_imgs_paths, traj_labels, traj_goal = self.extract_trajectory(dataset_dir, trajectory)
-                self.current_images_paths.extend(traj_imgs_paths)
-                self.labels = np.vstack([self.labels, traj_labels])
-                self.goal_image_paths.extend(traj_goal)
-
-        if not (len(self.current_images_paths) == self.labels.shape[0] == len(self.goal_image_paths)):
-            raise ValueError(f"Data length not consistent: "
-                            f"current_images={len(self.current_images_paths)}, "
-                            f"labels={self.labels.shape[0]}, "
-                            f"goal_image_tags={len(self.goal_image_paths)}")
-        else:
-            self._len = len(self.current_images_paths)
-        
+        # Sample index as flat arrays, paths are formatted on demand. Worker processes then
+        # share it without the refcount writes that make them copy lists of path strings.
+        traj_dataset, traj_names, traj_steps, traj_labels = [], [], [], []
+        for dataset_id, dataset_dir in enumerate(dataset_dirs):
+            names, steps, labels = self.index_dataset_dir(dataset_dir, self.index_cache)
+            traj_dataset.extend([dataset_id] * len(names))
+            traj_names.extend(names)
+            traj_steps.extend(steps)
+            traj_labels.extend(labels)
 
-        self.labels = torch.tensor(self.labels).to(dtype=torch.float32)
+        self.traj_dataset = np.array(traj_dataset, dtype=np.int32)      # Dataset dir of every trajectory
+        self.traj_names = np.array(traj_names, dtype='S')               # 'traj_XXX' of every trajectory
+        traj_lengths = [len(steps) for steps in traj_steps]
+        self.sample_traj = np.repeat(np.arange(len(traj_names), dtype=np.int32), traj_lengths)   # Trajectory of every sample
+        self.sample_step = np.concatenate(traj_steps) if traj_steps else np.empty(0, dtype='S')   # Step dir name of every sample
+        self._len = len(self.sample_traj)
+
+        # One goal image per trajectory
+        self.goal_indices = self.sample_traj
+
+        labels = np.concatenate(traj_labels, axis=0) if traj_labels else np.empty([0, 3])
+        self.labels = torch.tensor(labels).to(dtype=self.LABEL_DTYPE)
+
+        # Optional SharedImageCache of decoded step images, shared by all DataLoader workers.
+        # Set it after construction, it is sized by len(dataset)
+        self.image_cache = None
 
     def __len__(self):
         return self._len
 
     def __getitem__(self, idx):
 
-        step_imgs = self.load_step_images(self.current_images_paths[idx])
-        goal_img = self.load_goal_images(self.goal_image_paths[idx])
-        return step_imgs, goal_img, self.labels[idx]
-    
+        goal_idx = int(self.goal_indices[idx])
+        if self.feature_store is not None:
+            step = self.feature_store.load(self.step_image_paths(idx))                  # (5, 256, 384)
+        else:
+            step = self.image_cache.get(idx) if self.image_cache is not None else None
+            if step is None:
+                step = self.load_step_images(self.step_image_paths(idx))
+                if self.image_cache is not None:
+                    self.image_cache.put(idx, step)
+
+        if self.return_goal_index:
+            return step, goal_idx, self.labels[idx]
+        return step, self.goal_table()[goal_idx], self.labels[idx]
+
+    def trajectory_dir(self, traj):
+        return os.path.join(self.dataset_dirs[self.traj_dataset[traj]], self.traj_names[traj].decode())
+
+    def step_image_paths(self, idx):
+        # Paths of the 5 camera images of a sample
+        step_dir = os.path.join(self.trajectory_dir(self.sample_traj[idx]), self.sample_step[idx].decode())
+        return [os.path.join(step_dir, f'{i}.jpg') for i in range(5)]
+
+    def goal_image_path(self, goal_idx):
+        dataset_dir = self.dataset_dirs[self.traj_dataset[goal_idx]]
+        return os.path.join(dataset_dir, 'Goal_Images', f'{self.traj_names[goal_idx].decode()}.jpg')
+
+    @property
+    def goal_image_paths(self):
+        # One per distinct goal image
+        return [self.goal_image_path(goal_idx) for goal_idx in range(len(self.traj_names))]
+
+    def load_goal_table(self):
+        # (num_goals, 3, H, W) goal images, or (num_goals, 256, 384) goal tokens with a feature store
+        if self.feature_store is not None:
+            return self.feature_store.load(self.goal_image_paths)
+        goal_image_paths = self.goal_image_paths
+        if self.backend == 'torchvision':
+            return torch.cat([self.decode_images(goal_image_paths[start:start + GOAL_DECODE_BATCH])
+                              for start in range(0, len(goal_image_paths), GOAL_DECODE_BATCH)], dim=0)
+        return torch.stack([self.load_goal_images(path) for path in goal_image_paths], dim=0)
+
+    def index_cache_path(self, dataset_dir):
+        return os.path.join(dataset_dir, f'.index_{os.path.splitext(self.LABEL_FILE)[0]}.npz')
+
+    def trajectory_stamp(self, dataset_dir, trajectory):
+        # Changes whenever step dirs are added or removed, or the labels are rewritten
+        trajectory_dir = os.path.join(dataset_dir, trajectory)
+        return (os.stat(trajectory_dir).st_mtime_ns, os.stat(os.path.join(trajectory_dir, self.LABEL_FILE)).st_mtime_ns)
+
+    def index_dataset_dir(self, dataset_dir, use_cache=True):
+        # Names, step dir names and labels of every trajectory of a dataset dir.
+        # With the cache, only trajectories added or changed since it was written are rescanned
+        trajectories = [item for item in os.listdir(dataset_dir) if item.startswith('traj_')]
+        trajectories = sorted(trajectories, key=lambda x: int(x[5:]))
+        cache_path = self.index_cache_path(dataset_dir)
+        cached = self.load_index_cache(cache_path) if use_cache else {}
+
+        with ThreadPoolExecutor(SCAN_THREADS) as pool:
+            stamps = dict(zip(trajectories, pool.map(lambda trajectory: self.trajectory_stamp(dataset_dir, trajectory), trajectories)))
+            to_scan = [trajectory for trajectory in trajectories
+                       if trajectory not in cached or cached[trajectory][0] != stamps[trajectory]]
+            scanned = pool.map(lambda trajectory: self.extract_trajectory(dataset_dir, trajectory), to_scan)
+            for trajectory, (steps, labels) in zip(to_scan, scanned):
+                if len(steps) != labels.shape[0]:
+                    raise ValueError(f"Data length not consistent in {os.path.join(dataset_dir, trajectory)}: "
+                                     f"steps={len(steps)}, labels={labels.shape[0]}")
+                cached[trajectory] = (stamps[trajectory], np.array(steps, dtype='S'), labels)
+
+        if use_cache and (to_scan or len(cached) != len(trajectories)):
+            for trajectory in set(cached) - set(trajectories):
+                del cached[trajectory]
+            self.save_index_cache(cache_path, trajectories, cached)
+
+        return trajectories, [cached[trajectory][1] for trajectory in trajectories], [cached[trajectory][2] for trajectory in trajectories]
+
     @staticmethod
-    def extract_trajectory(dataset_dir, trajectory):
+    def load_index_cache(cache_path):
+        # trajectory -> (stamp, step dir names, labels), empty when there is no usable cache
+        if not os.path.exists(cache_path):
+            return {}
+        try:
+            with np.load(cache_path) as cache:
+                names, stamps, lengths = cache['traj_names'], cache['traj_stamps'], cache['traj_lengths']
+                steps = np.split(cache['steps'], np.cumsum(lengths)[:-1])
+                labels = np.split(cache['labels'], np.cumsum(lengths)[:-1])
+        except Exception as e:
+            # Any unreadable cache, e.g. a truncated npz (BadZipFile, EOFError), is rebuilt by a rescan
+            print(f'Ignoring index cache {cache_path}: {e!r}')
+            return {}
+        return {name.decode(): (tuple(stamp.tolist()), step, label)
+                for name, stamp, step, label in zip(names, stamps, steps, labels)}
+
+    @staticmethod
+    def save_index_cache(cache_path, trajectories, cached):
+        entries = [cached[trajectory] for trajectory in trajectories]
+        # Per-process temp file, runs indexing the same dataset dir together never write into each other's
+        tmp_path = f'{cache_path}.{os.getpid()}.tmp'
+        try:
+            # Write-then-rename, so that readers never see a partial cache
+            with open(tmp_path, 'wb') as f:
+                np.savez(f,
+                         traj_names=np.array(trajectories, dtype='S'),
+                         traj_stamps=np.array([stamp for stamp, _, _ in entries], dtype=np.int64).reshape(-1, 2),
+                         traj_lengths=np.array([len(steps) for _, steps, _ in entries], dtype=np.int64),
+                         steps=np.concatenate([steps for _, steps, _ in entries]) if entries else np.empty(0, dtype='S'),
+                         labels=np.concatenate([labels for _, _, labels in entries]) if entries else np.empty([0, 3]))
+            os.replace(tmp_path, cache_path)
+        except OSError as e:
+            print(f'Could not write index cache {cache_path}: {e}')
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    @classmethod
+    def extract_trajectory(cls, dataset_dir, trajectory):
 
         trajectory_dir = os.path.join(dataset_dir, trajectory)
+        # Step dirs, each holding the current images 0.jpg ... 4.jpg
         steps = [x for x in os.listdir(trajectory_dir) if x.isdigit()]
         steps = sorted(steps)
-        
-        # Goal Image Tags
-        goal_image_path = os.path.join(dataset_dir, 'Goal_Images', f'{trajectory}.jpg')
-        goal_image_paths = [goal_image_path] * len(steps)
 
         # Label
-        label_path = os.path.join(trajectory_dir, 'labels.npy')
+        label_path = os.path.join(trajectory_dir, cls.LABEL_FILE)
         traj_labels = np.load(label_path)
 
-        # Current Images
-        traj_imgs_paths = []
-        for step in steps:
-            step_path = os.path.join(trajectory_dir, step)
-            step_imgs_paths = []
-
-            for i in range(5):
-                img_path = os.path.join(step_path, f'{i}.jpg')
-                step_imgs_paths.append(img_path)
-            
-            # step_imgs = torch.stack(step_imgs, dim=0)
-            traj_imgs_paths.append(step_imgs_paths)
-
-        return traj_imgs_paths, traj_labels, goal_image_paths
+        return steps, traj_labels
 
     def load_step_images(self, step_image_paths):
+        if self.backend == 'torchvision':
+            return self.decode_images(step_image_paths)
+
         step_imgs = []
         for img_path in step_image_paths:
-            img = Image.open(img_path)
+            img = self.open_image(img_path)
             if self.transform:
                 img = self.transform(img)
             else:
                 img = transforms.ToTensor()(img)
-            img = img.to(dtype=torch.float32)
-            step_imgs.append(img)
+            step_imgs.append(self.to_float(img))
         
-        step_imgs = torch.stack(step_imgs, dim=0).to(dtype=torch.float32)
+        step_imgs = torch.stack(step_imgs, dim=0)
 
         return step_imgs
 
     def load_goal_images(self, goal_image_path):
-        img = Image.open(goal_image_path)
+        if self.backend == 'torchvision':
+            return self.decode_images([goal_image_path])[0]
+
+        img = self.open_image(goal_image_path)
         if self.transform:
                 img = self.transform(img)
         else:
             img = transforms.ToTensor()(img)
 
-        img = img.to(dtype=torch.float32)
+        return self.to_float(img)
 
+    def decode_images(self, image_paths):
+        # torchvision backend: one batched decode_jpeg call, then the transform on the stacked images
+        imgs = decode_jpeg([read_file(path) for path in image_paths], mode=ImageReadMode.RGB)
+        if len(set(img.shape for img in imgs)) == 1:
+            imgs = torch.stack(imgs, dim=0)
+            imgs = self.transform(imgs) if self.transform else imgs
+        else:
+            # Mixed resolutions, the transform has to bring them to one size
+            imgs = torch.stack([self.transform(img) if self.transform else img for img in imgs], dim=0)
+
+        if not self.transform:
+            # As ToTensor
+            return imgs.to(dtype=torch.float32).div_(255)
+        return self.to_float(imgs)
+
+    def open_image(self, img_path):
+        img = Image.open(img_path)
+        if self.draft_size is not None:
+            # Only configures the JPEG decoder, a no-op for other formats
+            img.draft('RGB', self.draft_size)
         return img
+
+    @staticmethod
+    def to_float(img):
+        # uint8 images from batch_transforms.uint8_transforms stay uint8, BatchNormalize converts them on device
+        if img.dtype == torch.uint8:
+            return img
+        return img.to(dtype=torch.float32)
@@ -0,0 +1,91 @@
+import os
+import json
+import torch
+from torch.utils.data import Dataset
+import numpy as np
+from goal_batching import GoalTableMixin
+
+class SPOT_SingleStep_Shard_DataLoader(GoalTableMixin, Dataset):
+    # SPOT_SingleStep_DataLoader on the uint8 image shards written by build_image_shards.py
+    # transform is applied to float32 images in [0, 1], uint8=True returns the uint8 images
+    def __init__(self, shard_dirs, transform=None, discretized=False, return_goal_index=False, unique_goals=False,
+                 uint8=False):
+        self.transform = transform
+        self.uint8 = uint8
+        self.init_goal_batching(return_goal_index, unique_goals)
+
+        if not isinstance(shard_dirs, list):
+            shard_dirs = [shard_dirs]
+        self.shard_dirs = shard_dirs
+
+        self.metas = []
+        goal_indices = []
+        labels = []
+        label_file = 'discretized_labels.npy' if discretized else 'labels.npy'
+        for shard_dir in shard_dirs:
+            meta_path = os.path.join(shard_dir, 'meta.json')
+            if not os.path.exists(meta_path):
+                raise ValueError(f'{shard_dir} is not converted, run build_image_shards.py first')
+            with open(meta_path) as f:
+                meta = json.load(f)
+            if discretized and not meta['discretized_labels']:
+                raise ValueError(f'{shard_dir} has no discretized labels')
+
+            self.metas.append(meta)
+            goal_indices.append(np.load(os.path.join(shard_dir, 'goal_index.npy')))
+            labels.append(np.load(os.path.join(shard_dir, label_file)))
+
+        # First global sample of every shard dir
+        self.offsets = np.cumsum([0] + [meta['num_samples'] for meta in self.metas])
+        self._len = int(self.offsets[-1])
+        # Goal of every sample, index into the goals of all shard dirs
+        goal_offsets = np.cumsum([0] + [meta['num_goals'] for meta in self.metas])
+        self.goal_indices = np.concatenate([goal_index + offset for goal_index, offset in zip(goal_indices, goal_offsets)])
+
+        self.labels = torch.from_numpy(np.concatenate(labels, axis=0)).to(dtype=torch.long if discretized else torch.float32)
+
+        # Memmaps are opened lazily, so every DataLoader worker maps the shards itself
+        self._memmaps = {}
+
+    def __len__(self):
+        return self._len
+
+    def __getstate__(self):
+        # Never pickle memmaps into workers, they would be copied
+        state = self.__dict__.copy()
+        state['_memmaps'] = {}
+        return state
+
+    def _memmap(self, dir_idx, file_name):
+        key = (dir_idx, file_name)
+        if key not in self._memmaps:
+            # Copy-on-write: writable views for torch.from_numpy, a write never reaches the file
+            self._memmaps[key] = np.load(os.path.join(self.shard_dirs[dir_idx], file_name), mmap_mode='c')
+        return self._memmaps[key]
+
+    def __getitem__(self, idx):
+        dir_idx = int(np.searchsorted(self.offsets, idx, side='right')) - 1
+        sample = idx - int(self.offsets[dir_idx])
+        shard_id, row = divmod(sample, self.metas[dir_idx]['shard_size'])
+
+        step_imgs = self.to_tensor(self._memmap(dir_idx, f'steps_{shard_id:05d}.npy')[row])
+        goal_idx = int(self.goal_indices[idx])
+
+        if self.return_goal_index:
+            return step_imgs, goal_idx, self.labels[idx]
+        return step_imgs, self.goal_table()[goal_idx], self.labels[idx]
+
+    def load_goal_table(self):
+        # (num_goals, 3, H, W) goal images of every shard dir
+        return torch.cat([self.to_tensor(self._memmap(dir_idx, 'goals.npy')) for dir_idx in range(len(self.shard_dirs))], dim=0)
+
+    def to_tensor(self, img):
+        # uint8 (..., 3, H, W) memmap view -> float32 in [0, 1], as ToTensor
+        # No copy, the tensor views the page cache until collate stacks the batch
+        img = torch.from_numpy(np.asarray(img))
+        if self.uint8:
+            return img
+        img = img.to(dtype=torch.float32).div_(255)
+        if self.transform:
+            img = self.transform(img)
+        return img
@@ -0,0 +1,144 @@
+import os
+import torch
+import torch.distributed as dist
+from torch.utils.data import IterableDataset, get_worker_info
+from torchvision import transforms
+from PIL import Image
+import numpy as np
+from SPOT_SingleStep_DataLoader import SPOT_SingleStep_DataLoader
+
+class SPOT_SingleStep_Stream_DataLoader(IterableDataset):
+    # Streaming SPOT_SingleStep_DataLoader: shards, here trajectories, are dealt out to DDP ranks and DataLoader
+    # workers every epoch, and their samples mixed in a shuffle buffer of shuffle_buffer_size samples.
+    # Under DDP every worker of every rank stops at the same sample count, so ranks run the same number of
+    # steps without model.join(), dropping the samples the readers hold beyond it (different ones every epoch)
+    def __init__(self, dataset_dirs, transform=None, discretized=False, shuffle_buffer_size=1024, seed=0,
+                 rank=None, world_size=None):
+        self.transform = transform
+        self.discretized = discretized
+        self.label_file = 'discretized_labels.npy' if discretized else 'labels.npy'
+        self.label_dtype = torch.long if discretized else torch.float32
+        self.shuffle_buffer_size = shuffle_buffer_size
+        self.seed = seed
+        # None takes them from torch.distributed when it is initialised
+        self.rank = rank
+        self.world_size = world_size
+
+        if not isinstance(dataset_dirs, list):
+            dataset_dirs = [dataset_dirs]
+        self.dataset_dirs = dataset_dirs
+
+        # Units dealt out to the readers and their number of samples, the only per-dataset state
+        self.shards, self.shard_lengths = self.list_shards()
+
+        self.epoch = 0
+        self.resume_samples = None
+
+    def list_shards(self):
+        # (dataset dir, 'traj_XXX') of every trajectory and its number of steps, from the label file header
+        shards, lengths = [], []
+        for dataset_dir in self.dataset_dirs:
+            trajectories = [item for item in os.listdir(dataset_dir) if item.startswith('traj_')]
+            for trajectory in sorted(trajectories, key=lambda x: int(x[5:])):
+                shards.append((dataset_dir, trajectory))
+                lengths.append(np.load(os.path.join(dataset_dir, trajectory, self.label_file), mmap_mode='r').shape[0])
+        return shards, lengths
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+        self.resume_samples = None
+
+    def resume(self, epoch, num_batches, batch_size, num_workers):
+        # Continue epoch after num_batches batches were consumed. The DataLoader takes whole batches from
+        # its workers in turn starting at worker 0, so worker w had made every num_workers-th batch from w.
+        # Exact as long as no worker of the rank ran out of samples before the position
+        self.epoch = epoch
+        self.resume_samples = (num_batches, batch_size, max(num_workers, 1))   # num_workers=0 reads in the main process
+
+    def _split(self):
+        # Index of this reader among all ranks and workers, their number and the number of ranks
+        rank, world_size = self.rank, self.world_size
+        if rank is None:
+            distributed = dist.is_available() and dist.is_initialized()
+            rank, world_size = (dist.get_rank(), dist.get_world_size()) if distributed else (0, 1)
+        worker_info = get_worker_info()
+        worker_id, num_workers = (worker_info.id, worker_info.num_workers) if worker_info is not None else (0, 1)
+        return rank * num_workers + worker_id, world_size * num_workers, world_size
+
+    def _reader_shards(self, reader, num_readers, world_size):
+        # Same shard order on every reader, each shard goes to the reader with the fewest samples so far,
+        # so readers end within one shard of each other. Returns the shards of this reader and the number
+        # of samples it reads, under DDP the smallest reader's so that every rank makes the same batches
+        order = np.random.default_rng([self.seed, self.epoch]).permutation(len(self.shards))
+        loads = np.zeros(num_readers, dtype=np.int64)
+        shards = []
+        for shard_idx in order:
+            owner = int(np.argmin(loads))
+            loads[owner] += self.shard_lengths[shard_idx]
+            if owner == reader:
+                shards.append(self.shards[shard_idx])
+        return shards, int(loads.min() if world_size > 1 else loads[reader])
+
+    def _skip(self):
+        # Samples of this worker consumed before the resume() position
+        if not self.resume_samples:
+            return 0
+        num_batches, batch_size, num_workers = self.resume_samples
+        worker_info = get_worker_info()
+        worker_id = worker_info.id if worker_info is not None else 0
+        if worker_info is not None and worker_info.num_workers != num_workers:
+            raise ValueError(f'resume() was given {num_workers} workers, the DataLoader has {worker_info.num_workers}')
+        return (num_batches - worker_id + num_workers - 1) // num_workers * batch_size
+
+    def _samples(self, trajectories, pending):
+        # (trajectory, step dir, label) of every step of the given trajectories, in order.
+        # pending counts the samples of each trajectory handed to the shuffle buffer
+        for dataset_dir, trajectory in trajectories:
+            trajectory_dir = os.path.join(dataset_dir, trajectory)
+            steps = sorted(x for x in os.listdir(trajectory_dir) if x.isdigit())
+            labels = np.load(os.path.join(trajectory_dir, self.label_file))
+            if len(steps) != labels.shape[0]:
+                raise ValueError(f"Data length not consistent in {trajectory_dir}: steps={len(steps)}, labels={labels.shape[0]}")
+            for step, label in zip(steps, labels):
+                pending[(dataset_dir, trajectory)] = pending.get((dataset_dir, trajectory), 0) + 1
+                yield (dataset_dir, trajectory), step, label
+
+    def _shuffled(self, samples, rng):
+        buffer = []
+        for sample in samples:
+            if len(buffer) < self.shuffle_buffer_size:
+                buffer.append(sample)
+                continue
+            slot = rng.integers(len(buffer))
+            yield buffer[slot]
+            buffer[slot] = sample
+        rng.shuffle(buffer)
+        yield from buffer
+
+    def __iter__(self):
+        reader, num_readers, world_size = self._split()
+        trajectories, num_samples = self._reader_shards(reader, num_readers, world_size)
+        # Goal images of the trajectories that still have samples in the buffer
+        goals, pending = {}, {}
+        samples = self._shuffled(self._samples(trajectories, pending), np.random.default_rng([self.seed, self.epoch, reader]))
+
+        skip = self._skip()
+        for sample_idx, (traj_key, step, label) in enumerate(samples):
+            if sample_idx == num_samples:
+                break
+            pending[traj_key] -= 1
+            if sample_idx >= skip:
+                if traj_key not in goals:
+                    goals[traj_key] = self.load_image(os.path.join(traj_key[0], 'Goal_Images', f'{traj_key[1]}.jpg'))
+                step_dir = os.path.join(traj_key[0], traj_key[1], step)
+                step_imgs = torch.stack([self.load_image(os.path.join(step_dir, f'{i}.jpg')) for i in range(5)], dim=0)
+                yield step_imgs, goals[traj_key], torch.tensor(label).to(dtype=self.label_dtype)
+            if pending[traj_key] == 0:
+                goals.pop(traj_key, None)
+                del pending[traj_key]
+
+    def load_image(self, img_path):
+        # img_path may also be a file object, e.g. encoded bytes of a tar shard
+        img = Image.open(img_path)
+        img = self.transform(img) if self.transform else transforms.ToTensor()(img)
+        return SPOT_SingleStep_DataLoader.to_float(img)
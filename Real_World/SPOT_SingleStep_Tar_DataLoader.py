@@ -0,0 +1,84 @@
+import io
+import os
+import json
+import tarfile
+import torch
+import numpy as np
+from SPOT_SingleStep_Stream_DataLoader import SPOT_SingleStep_Stream_DataLoader
+from goal_batching import GoalTableMixin
+
+READ_BUFFER = 16 << 20   # Bytes per read from a shard, large sequential reads for NFS and disks
+
+class SPOT_SingleStep_Tar_DataLoader(GoalTableMixin, SPOT_SingleStep_Stream_DataLoader):
+    # Streaming SPOT_SingleStep_DataLoader on the tar shards written by build_tar_shards.py
+    def __init__(self, shard_dirs, transform=None, discretized=False, return_goal_index=False, unique_goals=False,
+                 shuffle_buffer_size=1024, seed=0, rank=None, world_size=None):
+        self.init_goal_batching(return_goal_index, unique_goals)
+        super(SPOT_SingleStep_Tar_DataLoader, self).__init__(shard_dirs, transform=transform, discretized=discretized,
+                                                             shuffle_buffer_size=shuffle_buffer_size, seed=seed,
+                                                             rank=rank, world_size=world_size)
+        # First global goal of every shard dir
+        self.goal_offsets = np.cumsum([0] + [meta['num_goals'] for meta in self.metas])
+
+    def list_shards(self):
+        # (shard dir index, shard name) of every tar shard and its number of records
+        self.metas = []
+        for shard_dir in self.dataset_dirs:
+            meta_path = os.path.join(shard_dir, 'meta.json')
+            if not os.path.exists(meta_path):
+                raise ValueError(f'{shard_dir} is not packed, run build_tar_shards.py first')
+            with open(meta_path) as f:
+                meta = json.load(f)
+            if self.discretized and not meta['discretized_labels']:
+                raise ValueError(f'{shard_dir} has no discretized labels')
+            self.metas.append(meta)
+        shards = [(dir_idx, shard['name']) for dir_idx, meta in enumerate(self.metas) for shard in meta['shards']]
+        return shards, [shard['num_samples'] for meta in self.metas for shard in meta['shards']]
+
+    def _records(self, shards):
+        # (encoded camera images, goal index, label) of every record of the given shards, in order
+        for dir_idx, shard_name in shards:
+            with open(os.path.join(self.dataset_dirs[dir_idx], shard_name), 'rb', buffering=READ_BUFFER) as f, \
+                    tarfile.open(fileobj=f, mode='r|') as tar:
+                key, record = None, {}
+                for member in tar:
+                    member_key, field = member.name.split('.', 1)
+                    if member_key != key:
+                        if record:
+                            yield self._record(dir_idx, record)
+                        key, record = member_key, {}
+                    record[field] = tar.extractfile(member).read()
+                if record:
+                    yield self._record(dir_idx, record)
+
+    def _record(self, dir_idx, record):
+        images = [record[f'{i}.jpg'] for i in range(5)]
+        goal_idx = json.loads(record['goal.json'])['goal'] + int(self.goal_offsets[dir_idx])
+        label = np.load(io.BytesIO(record[self.label_file]))
+        return images, goal_idx, label
+
+    def __iter__(self):
+        reader, num_readers, world_size = self._split()
+        shards, num_samples = self._reader_shards(reader, num_readers, world_size)
+        records = self._shuffled(self._records(shards), np.random.default_rng([self.seed, self.epoch, reader]))
+
+        skip = self._skip()
+        for sample_idx, (images, goal_idx, label) in enumerate(records):
+            if sample_idx == num_samples:
+                break
+            if sample_idx < skip:
+                continue
+            step_imgs = torch.stack([self.load_image(io.BytesIO(image)) for image in images], dim=0)
+            label = torch.tensor(label).to(dtype=self.label_dtype)
+            if self.return_goal_index:
+                yield step_imgs, goal_idx, label
+            else:
+                yield step_imgs, self.goal_table()[goal_idx], label
+
+    def load_goal_table(self):
+        # (num_goals, 3, H, W) goal images of every shard dir
+        goals = []
+        for shard_dir in self.dataset_dirs:
+            with tarfile.open(os.path.join(shard_dir, 'goals.tar')) as tar:
+                goals.extend(self.load_image(io.BytesIO(tar.extractfile(member).read())) for member in tar)
+        return torch.stack(goals, dim=0)
@@ -0,0 +1,116 @@
+import os
+import json
+from collections import OrderedDict
+import torch
+from torchvision import transforms
+import numpy as np
+from SPOT_SingleStep_DataLoader import SPOT_SingleStep_DataLoader
+
+# PyAV is only needed for the video format
+try:
+    import av
+except ImportError:
+    av = None
+
+OPEN_TRAJECTORIES = 8   # Trajectories per process whose camera videos are kept open, when the batches are not given
+SEEK_DISTANCE = 32      # Frames ahead of the decoder that are reached by decoding forward rather than seeking
+
+class CameraVideo:
+    # One camera video of a trajectory, decoding forward from the last frame read and seeking otherwise
+    def __init__(self, path, fps):
+        self.container = av.open(path)
+        self.stream = self.container.streams.video[0]
+        self.stream.thread_type = 'AUTO'
+        self.fps = fps
+        self.frames = None
+        self.next_frame = 0
+
+    def read(self, frame_idx):
+        if self.frames is None or not self.next_frame <= frame_idx < self.next_frame + SEEK_DISTANCE:
+            # Seeks to the keyframe at or before frame_idx
+            self.container.seek(int(frame_idx / self.fps / self.stream.time_base), stream=self.stream)
+            self.frames = self.container.decode(self.stream)
+        for frame in self.frames:
+            decoded_idx = int(round(frame.time * self.fps))
+            self.next_frame = decoded_idx + 1
+            if decoded_idx >= frame_idx:
+                return frame.to_image()
+        raise IndexError(f'Frame {frame_idx} is past the end of {self.container.name}')
+
+    def close(self):
+        self.container.close()
+
+class SPOT_SingleStep_Video_DataLoader(SPOT_SingleStep_DataLoader):
+    # SPOT_SingleStep_DataLoader on the per-trajectory camera videos written by build_trajectory_videos.py
+    def __init__(self, video_dirs, transform=None, discretized=False, return_goal_index=False, unique_goals=False,
+                 batch_size=None, chunk_size=1):
+        if av is None:
+            raise ImportError('SPOT_SingleStep_Video_DataLoader needs PyAV, pip install av')
+        if discretized:
+            self.LABEL_FILE = 'discretized_labels.npy'
+            self.LABEL_DTYPE = torch.long
+        self.metas = {}
+        super(SPOT_SingleStep_Video_DataLoader, self).__init__(video_dirs, transform=transform, return_goal_index=return_goal_index,
+                                                               unique_goals=unique_goals, index_cache=False)
+
+        # Frame of every sample in its trajectory videos
+        traj_starts = np.searchsorted(self.sample_traj, np.arange(len(self.traj_names)))
+        self.sample_frame = np.arange(self._len, dtype=np.int64) - traj_starts[self.sample_traj]
+
+        # Open camera videos of the most recently read trajectories, per process. A batch of
+        # TrajectoryChunkBatchSampler chunks reads up to one trajectory per chunk, and a chunk
+        # can straddle two batches, so every trajectory of the batch stays open while it is read
+        if batch_size is None:
+            self.open_trajectories = OPEN_TRAJECTORIES
+        else:
+            self.open_trajectories = -(-batch_size // chunk_size) + 1
+        self._videos = OrderedDict()
+
+    def __getstate__(self):
+        # Open containers stay in the process that opened them
+        state = self.__dict__.copy()
+        state['_videos'] = OrderedDict()
+        return state
+
+    def index_dataset_dir(self, dataset_dir, use_cache=True):
+        # Names, step dir names and labels of every trajectory, from meta.json and the copied labels
+        meta_path = os.path.join(dataset_dir, 'meta.json')
+        if not os.path.exists(meta_path):
+            raise ValueError(f'{dataset_dir} is not converted, run build_trajectory_videos.py first')
+        with open(meta_path) as f:
+            meta = json.load(f)
+        self.metas[dataset_dir] = meta
+
+        names = [trajectory['name'] for trajectory in meta['trajectories']]
+        steps = [np.array(trajectory['steps'], dtype='S') for trajectory in meta['trajectories']]
+        labels = [np.load(os.path.join(dataset_dir, name, self.LABEL_FILE)) for name in names]
+        return names, steps, labels
+
+    def camera_videos(self, traj):
+        if traj in self._videos:
+            self._videos.move_to_end(traj)
+        else:
+            if len(self._videos) == self.open_trajectories:
+                for video in self._videos.popitem(last=False)[1]:
+                    video.close()
+            fps = self.metas[self.dataset_dirs[self.traj_dataset[traj]]]['fps']
+            self._videos[traj] = [CameraVideo(os.path.join(self.trajectory_dir(traj), f'{i}.mp4'), fps) for i in range(5)]
+        return self._videos[traj]
+
+    def __getitem__(self, idx):
+
+        goal_idx = int(self.goal_indices[idx])
+        frame_idx = int(self.sample_frame[idx])
+        step_imgs = []
+        for video in self.camera_videos(int(self.sample_traj[idx])):
+            img = video.read(frame_idx)
+            if self.transform:
+                img = self.transform(img)
+            else:
+                img = transforms.ToTensor()(img)
+            step_imgs.append(self.to_float(img))
+        step = torch.stack(step_imgs, dim=0)
+
+        if self.return_goal_index:
+            return step, goal_idx, self.labels[idx]
+        return step, self.goal_table()[goal_idx], self.labels[idx]
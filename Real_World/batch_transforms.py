@@ -0,0 +1,30 @@
+import torch
+import torch.nn as nn
+from torchvision import transforms
+
+IMAGENET_MEAN = [0.485, 0.456, 0.406]
+IMAGENET_STD = [0.229, 0.224, 0.225]
+
+# Worker-side transform of the uint8 pipeline: resized uint8 (3, 224, 224) tensors, 4x fewer
+# bytes through worker IPC, pin_memory and the host to device copy than float32
+uint8_transforms = transforms.Compose([
+    transforms.Resize((224, 224)),
+    transforms.PILToTensor()
+])
+
+# The same for the 'torchvision' dataset backend, which decodes to uint8 tensors itself
+tensor_uint8_transforms = transforms.Resize((224, 224), antialias=True)
+
+class BatchNormalize(nn.Module):
+    # ToTensor + Normalize of a (..., 3, H, W) uint8 batch on its device, float inputs pass through
+    def __init__(self, mean=IMAGENET_MEAN, std=IMAGENET_STD):
+        super(BatchNormalize, self).__init__()
+        # Folds the division by 255 into the affine transform: x * scale + shift
+        mean, std = torch.tensor(mean), torch.tensor(std)
+        self.register_buffer('scale', (1 / (255 * std)).view(3, 1, 1))
+        self.register_buffer('shift', (-mean / std).view(3, 1, 1))
+
+    def forward(self, x):
+        if x.dtype != torch.uint8:
+            return x
+        return torch.addcmul(self.shift, x.to(dtype=torch.float32), self.scale)
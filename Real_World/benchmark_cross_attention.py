@@ -0,0 +1,73 @@
+import time
+import torch
+from models.cross_attention import CrossAttentionBlock, BidirectionalCrossAttention
+from check_equivalence import LegacyCrossAttentionBlock, to_tokens
+
+# Compares the SDPA cross-attention against the nn.MultiheadAttention block it replaces:
+# one block call per camera and direction as the models used to run, against the single
+# bidirectional call, both forward only and forward + backward.
+
+NUM_CAMERAS = 5
+EMBED_DIMS = [384, 768]
+BATCH_SIZE = 8
+GRID_SIZE = (16, 16)
+NUM_REPEATS = 10
+
+def legacy_per_camera(block, current_feats, goal_feats):
+    outputs = []
+    for cam_idx in range(NUM_CAMERAS):
+        curr_feat = current_feats[:, cam_idx]
+        outputs.append(block(curr_feat, goal_feats))
+        outputs.append(block(goal_feats, curr_feat))
+    return torch.stack(outputs)
+
+def synchronize():
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+
+def time_fn(fn, backward=False):
+    def step():
+        output = fn()
+        if backward:
+            output.sum().backward()
+
+    step()
+    synchronize()
+    start = time.perf_counter()
+    for _ in range(NUM_REPEATS):
+        step()
+    synchronize()
+    return (time.perf_counter() - start) / NUM_REPEATS * 1e3
+
+if __name__ == '__main__':
+    DEVICE = 'cuda' if torch.cuda.is_available() else 'cpu'
+
+    for embed_dim in EMBED_DIMS:
+        legacy = LegacyCrossAttentionBlock(embed_dim).to(DEVICE)
+        block = CrossAttentionBlock(embed_dim).to(DEVICE)
+        batched = BidirectionalCrossAttention(embed_dim).to(DEVICE)
+        block.load_state_dict(legacy.state_dict())
+        batched.load_state_dict(legacy.state_dict())
+
+        current_feats = torch.randn(BATCH_SIZE, NUM_CAMERAS, embed_dim, *GRID_SIZE, device=DEVICE, requires_grad=True)
+        goal_feats = torch.randn(BATCH_SIZE, embed_dim, *GRID_SIZE, device=DEVICE, requires_grad=True)
+        current_tokens = to_tokens(current_feats.detach()).requires_grad_()
+        goal_tokens = to_tokens(goal_feats.detach()).requires_grad_()
+        query, key_value = current_feats[:, 0].detach(), goal_feats.detach()
+
+        runs = [
+            ('single block',
+             lambda: legacy(query, key_value),
+             lambda: block(to_tokens(query), to_tokens(key_value))),
+            (f'{NUM_CAMERAS} cameras both directions',
+             lambda: legacy_per_camera(legacy, current_feats, goal_feats),
+             lambda: torch.stack(batched(current_tokens, goal_tokens))),
+        ]
+        for name, legacy_fn, sdpa_fn in runs:
+            for backward in (False, True):
+                with torch.set_grad_enabled(backward):
+                    legacy_ms = time_fn(legacy_fn, backward)
+                    sdpa_ms = time_fn(sdpa_fn, backward)
+                mode = 'forward + backward' if backward else 'forward'
+                print(f'{embed_dim} {name}, {mode}: nn.MultiheadAttention {legacy_ms:.1f} ms, '
+                      f'SDPA {sdpa_ms:.1f} ms, speedup {legacy_ms / sdpa_ms:.2f}x')
@@ -0,0 +1,54 @@
+import os
+import time
+import shutil
+import tempfile
+import numpy as np
+from SPOT_SingleStep_DataLoader import SPOT_SingleStep_DataLoader
+
+# Dataset construction time on a synthetic dataset dir: without the index cache, cold
+# (writing the cache), warm, and after a few trajectories changed. Run it with TMP_DIR
+# on the NFS volume to see the effect of file system latency.
+
+TMP_DIR = None   # None uses the system temp dir
+NUM_TRAJECTORIES = 300
+TRAJECTORY_LENGTH = 50
+NUM_CHANGED = 5
+
+def make_dataset_dir(root):
+    dataset_dir = os.path.join(root, 'map_synthetic')
+    for traj in range(NUM_TRAJECTORIES):
+        trajectory_dir = os.path.join(dataset_dir, f'traj_{traj}')
+        for step in range(TRAJECTORY_LENGTH):
+            os.makedirs(os.path.join(trajectory_dir, f'{step:03d}'))
+        np.save(os.path.join(trajectory_dir, 'labels.npy'), np.random.rand(TRAJECTORY_LENGTH, 3))
+    return dataset_dir
+
+def time_construction(dataset_dir, index_cache):
+    start = time.perf_counter()
+    dataset = SPOT_SingleStep_DataLoader(dataset_dirs=dataset_dir, index_cache=index_cache)
+    return (time.perf_counter() - start) * 1e3, dataset
+
+if __name__ == '__main__':
+    root = tempfile.mkdtemp(dir=TMP_DIR)
+    try:
+        dataset_dir = make_dataset_dir(root)
+        print(f'{NUM_TRAJECTORIES} trajectories of {TRAJECTORY_LENGTH} steps')
+
+        uncached_ms, reference = time_construction(dataset_dir, index_cache=False)
+        cold_ms, _ = time_construction(dataset_dir, index_cache=True)
+        warm_ms, warm = time_construction(dataset_dir, index_cache=True)
+        assert np.array_equal(warm.sample_step, reference.sample_step)
+        assert np.array_equal(warm.labels.numpy(), reference.labels.numpy())
+
+        # One more step in a few trajectories
+        for traj in range(NUM_CHANGED):
+            trajectory_dir = os.path.join(dataset_dir, f'traj_{traj}')
+            os.makedirs(os.path.join(trajectory_dir, f'{TRAJECTORY_LENGTH:03d}'))
+            np.save(os.path.join(trajectory_dir, 'labels.npy'), np.random.rand(TRAJECTORY_LENGTH + 1, 3))
+        changed_ms, changed = time_construction(dataset_dir, index_cache=True)
+        assert len(changed) == len(reference) + NUM_CHANGED
+
+        print(f'No cache {uncached_ms:.1f} ms, cold {cold_ms:.1f} ms, warm {warm_ms:.1f} ms, '
+              f'{NUM_CHANGED} trajectories changed {changed_ms:.1f} ms')
+    finally:
+        shutil.rmtree(root)
@@ -0,0 +1,72 @@
+import multiprocessing
+import numpy as np
+import torch
+from SPOT_SingleStep_DataLoader import SPOT_SingleStep_DataLoader
+
+# Per-worker memory of the sample index, for a synthetic dataset of NUM_SAMPLES samples:
+# the former list of five path strings per sample against the flat array index.
+# Workers are forked as by the DataLoader and format the paths of every sample, so the
+# index pages they touch are copied. Reported is the memory private to each worker.
+
+NUM_SAMPLES = 1000000
+TRAJECTORY_LENGTH = 100
+DATASET_DIRS = [f'/data/lee04484/SPOT_Real_World_Dataset/cleanup_dataset/map01_0{i // 2 + 1}{"ab"[i % 2]}' for i in range(6)]
+NUM_WORKERS = 4
+
+def synthetic_array_dataset():
+    # Same index as SPOT_SingleStep_DataLoader builds from disk
+    dataset = SPOT_SingleStep_DataLoader.__new__(SPOT_SingleStep_DataLoader)
+    num_trajectories = NUM_SAMPLES // TRAJECTORY_LENGTH
+    dataset.dataset_dirs = DATASET_DIRS
+    dataset.traj_dataset = (np.arange(num_trajectories) % len(DATASET_DIRS)).astype(np.int32)
+    dataset.traj_names = np.array([f'traj_{traj}' for traj in range(num_trajectories)], dtype='S')
+    dataset.sample_traj = np.repeat(np.arange(num_trajectories, dtype=np.int32), TRAJECTORY_LENGTH)
+    dataset.sample_step = np.tile(np.array([f'{step:03d}' for step in range(TRAJECTORY_LENGTH)], dtype='S'), num_trajectories)
+    dataset.goal_indices = dataset.sample_traj
+    dataset.labels = torch.zeros(NUM_SAMPLES, 3)
+    dataset._len = NUM_SAMPLES
+    return dataset
+
+def synthetic_list_index(dataset):
+    # The former index: five path strings per sample and a goal path per sample
+    current_images_paths = [dataset.step_image_paths(idx) for idx in range(NUM_SAMPLES)]
+    goal_image_paths = [dataset.goal_image_path(goal_idx) for goal_idx in dataset.goal_indices]
+    return current_images_paths, goal_image_paths
+
+def private_memory_mb():
+    # Pages of this process not shared with any other, i.e. copied after fork
+    private_kb = 0
+    with open('/proc/self/smaps_rollup') as f:
+        for line in f:
+            if line.startswith(('Private_Clean:', 'Private_Dirty:')):
+                private_kb += int(line.split()[1])
+    return private_kb / 1024
+
+def worker(get_paths, worker_id, queue):
+    baseline = private_memory_mb()
+    for idx in range(worker_id, NUM_SAMPLES, NUM_WORKERS):
+        get_paths(idx)
+    queue.put(private_memory_mb() - baseline)
+
+def measure(get_paths):
+    # Forked workers inherit the index like DataLoader workers, returns the growth of their private memory
+    context = multiprocessing.get_context('fork')
+    queue = context.Queue()
+    workers = [context.Process(target=worker, args=(get_paths, worker_id, queue)) for worker_id in range(NUM_WORKERS)]
+    for process in workers:
+        process.start()
+    growth = [queue.get() for _ in workers]
+    for process in workers:
+        process.join()
+    return growth
+
+if __name__ == '__main__':
+    dataset = synthetic_array_dataset()
+    array_growth = measure(lambda idx: (dataset.step_image_paths(idx), dataset.goal_image_path(dataset.goal_indices[idx])))
+
+    current_images_paths, goal_image_paths = synthetic_list_index(dataset)
+    list_growth = measure(lambda idx: (current_images_paths[idx], goal_image_paths[idx]))
+
+    print(f'{NUM_SAMPLES} samples, {NUM_WORKERS} workers, private memory growth per worker')
+    print(f'Path lists:  {np.mean(list_growth):8.1f} MB (max {np.max(list_growth):.1f} MB)')
+    print(f'Flat arrays: {np.mean(array_growth):8.1f} MB (max {np.max(array_growth):.1f} MB)')
@@ -0,0 +1,55 @@
+import os
+import time
+import shutil
+import tempfile
+from torch.utils.data import DataLoader, Subset
+from SPOT_SingleStep_DataLoader import SPOT_SingleStep_DataLoader
+from batch_transforms import uint8_transforms, tensor_uint8_transforms
+from benchmark_jpeg_draft import DATASET_PATH, SYNTHETIC_SIZE, make_synthetic_dataset
+
+# Loading throughput of the 'pil' and 'torchvision' dataset backends, both returning
+# uint8 224x224 images, in the main process and through DataLoader workers.
+# Uses the samples of DATASET_PATH when it exists, otherwise synthetic camera-sized JPEGs.
+
+NUM_SAMPLES = 50
+BATCH_SIZE = 16
+NUM_WORKERS = [0, 4]
+
+def samples_per_second(dataset, num_workers):
+    subset = Subset(dataset, range(min(NUM_SAMPLES, len(dataset))))
+    dataloader = DataLoader(subset, batch_size=BATCH_SIZE, num_workers=num_workers, collate_fn=dataset.collate_fn)
+    start = time.perf_counter()
+    num_samples = 0
+    for current_images, _, _ in dataloader:
+        num_samples += current_images.size(0)
+    return num_samples / (time.perf_counter() - start)
+
+if __name__ == '__main__':
+    tmp_dir = None
+    if os.path.exists(DATASET_PATH):
+        dataset_path = DATASET_PATH
+    else:
+        tmp_dir = tempfile.mkdtemp()
+        dataset_path = make_synthetic_dataset(tmp_dir)
+        print(f'{DATASET_PATH} not found, using synthetic {SYNTHETIC_SIZE[0]}x{SYNTHETIC_SIZE[1]} JPEGs')
+
+    try:
+        datasets = {
+            backend: SPOT_SingleStep_DataLoader(dataset_dirs=dataset_path, transform=transform, index_cache=False,
+                                                return_goal_index=True, backend=backend)
+            for backend, transform in [('pil', uint8_transforms), ('torchvision', tensor_uint8_transforms)]
+        }
+
+        # Both backends decode with libjpeg and resize with antialiasing, only rounding differs
+        paths = datasets['pil'].step_image_paths(0)
+        diff = (datasets['pil'].load_step_images(paths).float() - datasets['torchvision'].load_step_images(paths).float()).abs()
+        print(f'Backend difference in grey levels: mean {diff.mean().item():.2f}, max {diff.max().item():.0f}')
+
+        for num_workers in NUM_WORKERS:
+            throughput = {backend: samples_per_second(dataset, num_workers) for backend, dataset in datasets.items()}
+            print(f'{num_workers} workers: pil {throughput["pil"]:.1f} samples/s, '
+                  f'torchvision {throughput["torchvision"]:.1f} samples/s, '
+                  f'speedup {throughput["torchvision"] / throughput["pil"]:.2f}x')
+    finally:
+        if tmp_dir is not None:
+            shutil.rmtree(tmp_dir)
@@ -0,0 +1,55 @@
+import os
+import time
+import shutil
+import tempfile
+import torch
+from torch.utils.data import DataLoader
+from SPOT_SingleStep_DataLoader import SPOT_SingleStep_DataLoader
+from shared_image_cache import SharedImageCache
+from batch_transforms import uint8_transforms
+from benchmark_jpeg_draft import DATASET_PATH, SYNTHETIC_SIZE, make_synthetic_dataset
+
+# Epoch times through DataLoader workers with the SharedImageCache: the first epoch
+# decodes and fills the cache, later ones read from shared memory. Also checks that the
+# cached samples equal freshly decoded ones, and that a small budget evicts without errors.
+
+NUM_EPOCHS = 3
+BATCH_SIZE = 16
+NUM_WORKERS = 4
+
+def run_epoch(dataset):
+    dataloader = DataLoader(dataset, batch_size=BATCH_SIZE, shuffle=True, num_workers=NUM_WORKERS,
+                            collate_fn=dataset.collate_fn)
+    start = time.perf_counter()
+    for _ in dataloader:
+        pass
+    return time.perf_counter() - start
+
+if __name__ == '__main__':
+    tmp_dir = None
+    if os.path.exists(DATASET_PATH):
+        dataset_path = DATASET_PATH
+    else:
+        tmp_dir = tempfile.mkdtemp()
+        dataset_path = make_synthetic_dataset(tmp_dir)
+        print(f'{DATASET_PATH} not found, using synthetic {SYNTHETIC_SIZE[0]}x{SYNTHETIC_SIZE[1]} JPEGs')
+
+    try:
+        dataset = SPOT_SingleStep_DataLoader(dataset_dirs=dataset_path, transform=uint8_transforms, index_cache=False,
+                                             return_goal_index=True)
+        item_bytes = 5 * 3 * 224 * 224
+
+        for budget_fraction in [1.0, 0.5]:
+            dataset.image_cache = SharedImageCache(len(dataset), (5, 3, 224, 224), int(len(dataset) * item_bytes * budget_fraction))
+            epoch_times = [run_epoch(dataset) for _ in range(NUM_EPOCHS)]
+            print(f'Budget {budget_fraction:.0%} of the dataset, {len(dataset.image_cache)}/{len(dataset)} samples cached, '
+                  f'epochs: {", ".join(f"{t:.2f} s" for t in epoch_times)}')
+
+            for idx in range(len(dataset)):
+                cached = dataset.image_cache.get(idx)
+                if cached is not None:
+                    assert torch.equal(cached, dataset.load_step_images(dataset.step_image_paths(idx))), idx
+            dataset.image_cache.close()
+    finally:
+        if tmp_dir is not None:
+            shutil.rmtree(tmp_dir)
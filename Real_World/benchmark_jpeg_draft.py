@@ -0,0 +1,90 @@
+import os
+import time
+import shutil
+import tempfile
+import numpy as np
+from torchvision import transforms
+from PIL import Image
+from SPOT_SingleStep_DataLoader import SPOT_SingleStep_DataLoader
+from batch_transforms import IMAGENET_MEAN, IMAGENET_STD
+
+# Decode time per sample (5 cameras) of full-resolution decoding against DCT-domain
+# downscaled decoding (draft_size), and how far the resulting tensors are apart.
+# Uses the samples of DATASET_PATH when it exists, otherwise synthetic camera-sized JPEGs.
+
+DATASET_PATH = '/data/lee04484/SPOT_Real_World_Dataset/cleanup_dataset/map01_01a'
+NUM_SAMPLES = 50
+SYNTHETIC_SIZE = (1280, 720)
+
+# Max mean / max absolute difference of normalised tensors, about 2 / 40 grey levels
+MEAN_TOLERANCE = 2 / 255 / min(IMAGENET_STD)
+MAX_TOLERANCE = 40 / 255 / min(IMAGENET_STD)
+
+data_transforms = transforms.Compose([
+    transforms.Resize((224, 224)),
+    transforms.ToTensor(),
+    transforms.Normalize(IMAGENET_MEAN, IMAGENET_STD)
+])
+
+def make_synthetic_dataset(root):
+    # One trajectory of smooth images with sensor-like noise, camera resolution, and its goal image
+    rng = np.random.default_rng(0)
+    trajectory_dir = os.path.join(root, 'traj_0')
+    width, height = SYNTHETIC_SIZE
+    x, y = np.meshgrid(np.linspace(0, 1, width), np.linspace(0, 1, height))
+
+    def save_image(path):
+        phase = rng.uniform(0, 2 * np.pi, 3)
+        img = np.stack([np.sin(8 * x + 5 * y + p) for p in phase], axis=-1) * 100 + 128
+        img = np.clip(img + rng.normal(0, 8, img.shape), 0, 255).astype(np.uint8)
+        Image.fromarray(img).save(path, quality=90)
+
+    for step in range(NUM_SAMPLES):
+        step_dir = os.path.join(trajectory_dir, f'{step:03d}')
+        os.makedirs(step_dir)
+        for cam_idx in range(5):
+            save_image(os.path.join(step_dir, f'{cam_idx}.jpg'))
+    os.makedirs(os.path.join(root, 'Goal_Images'))
+    save_image(os.path.join(root, 'Goal_Images', 'traj_0.jpg'))
+    np.save(os.path.join(trajectory_dir, 'labels.npy'), np.zeros((NUM_SAMPLES, 3)))
+    return root
+
+def time_samples(dataset, num_samples):
+    start = time.perf_counter()
+    for idx in range(num_samples):
+        dataset.load_step_images(dataset.step_image_paths(idx))
+    return (time.perf_counter() - start) / num_samples * 1e3
+
+if __name__ == '__main__':
+    tmp_dir = None
+    if os.path.exists(DATASET_PATH):
+        dataset_path = DATASET_PATH
+    else:
+        tmp_dir = tempfile.mkdtemp()
+        dataset_path = make_synthetic_dataset(tmp_dir)
+        print(f'{DATASET_PATH} not found, using synthetic {SYNTHETIC_SIZE[0]}x{SYNTHETIC_SIZE[1]} JPEGs')
+
+    try:
+        full = SPOT_SingleStep_DataLoader(dataset_dirs=dataset_path, transform=data_transforms, index_cache=False)
+        draft = SPOT_SingleStep_DataLoader(dataset_dirs=dataset_path, transform=data_transforms, index_cache=False,
+                                           draft_size=(224, 224))
+        num_samples = min(NUM_SAMPLES, len(full))
+        print(f'Source resolution {Image.open(full.step_image_paths(0)[0]).size}, {num_samples} samples')
+
+        mean_diffs, max_diffs = [], []
+        for idx in range(num_samples):
+            paths = full.step_image_paths(idx)
+            diff = (full.load_step_images(paths) - draft.load_step_images(paths)).abs()
+            mean_diffs.append(diff.mean().item())
+            max_diffs.append(diff.max().item())
+
+        full_ms = time_samples(full, num_samples)
+        draft_ms = time_samples(draft, num_samples)
+        print(f'Full decode {full_ms:.1f} ms / sample, draft decode {draft_ms:.1f} ms / sample, '
+              f'speedup {full_ms / draft_ms:.2f}x')
+        print(f'Normalised difference: mean {np.mean(mean_diffs):.4f} (tolerance {MEAN_TOLERANCE:.4f}), '
+              f'max {np.max(max_diffs):.4f} (tolerance {MAX_TOLERANCE:.4f})')
+        assert np.mean(mean_diffs) < MEAN_TOLERANCE and np.max(max_diffs) < MAX_TOLERANCE
+    finally:
+        if tmp_dir is not None:
+            shutil.rmtree(tmp_dir)
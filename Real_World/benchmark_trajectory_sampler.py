@@ -0,0 +1,44 @@
+import numpy as np
+from trajectory_sampler import TrajectoryChunkBatchSampler
+
+# Locality against randomness of TrajectoryChunkBatchSampler for a range of chunk sizes,
+# on synthetic trajectories. chunk_size=1 is the plain shuffle baseline.
+#   goals / batch:      unique goals (trajectories) per batch, what the goal side has to encode
+#   sequential reads:   fraction of samples directly following the previous sample of the batch
+#   rank correlation:   between a sample's position in the epoch and its position in the
+#                       dataset, ~0 for a full shuffle
+#   epoch overlap:      fraction of sample pairs sharing a batch in two consecutive epochs
+
+NUM_TRAJECTORIES = 600
+TRAJECTORY_LENGTHS = (20, 120)
+BATCH_SIZE = 128
+CHUNK_SIZES = [1, 4, 8, 16, 32]
+
+def batch_pairs(batches):
+    # Set of (i, j) sample pairs in the same batch, on a subsample to keep it small
+    pairs = set()
+    for batch in batches:
+        batch = sorted(batch)[::8]
+        pairs.update((i, j) for i in batch for j in batch if i < j)
+    return pairs
+
+if __name__ == '__main__':
+    rng = np.random.default_rng(0)
+    lengths = rng.integers(*TRAJECTORY_LENGTHS, size=NUM_TRAJECTORIES)
+    goal_indices = np.repeat(np.arange(NUM_TRAJECTORIES), lengths)
+    print(f'{len(goal_indices)} samples, {NUM_TRAJECTORIES} trajectories, batch size {BATCH_SIZE}')
+
+    for chunk_size in CHUNK_SIZES:
+        sampler = TrajectoryChunkBatchSampler(goal_indices, BATCH_SIZE, chunk_size=chunk_size)
+        batches = list(sampler)
+        next_batches = list(sampler)
+
+        goals_per_batch = np.mean([len(np.unique(goal_indices[batch])) for batch in batches])
+        sequential = np.mean([np.mean(np.diff(batch) == 1) for batch in batches if len(batch) > 1])
+        order = np.concatenate(batches)
+        rank_correlation = np.corrcoef(np.arange(len(order)), order)[0, 1]
+        pairs, next_pairs = batch_pairs(batches), batch_pairs(next_batches)
+        overlap = len(pairs & next_pairs) / max(len(pairs), 1)
+
+        print(f'chunk {chunk_size:3d}: goals / batch {goals_per_batch:6.1f}, sequential reads {sequential:.2f}, '
+              f'rank correlation {rank_correlation:+.3f}, epoch overlap {overlap:.3f}')
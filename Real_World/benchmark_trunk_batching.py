@@ -0,0 +1,54 @@
+import time
+import torch
+from models.Resnet18MLP5 import SharedResNet18MLP5
+from models.trunk_batching import fold_views, unfold_views, run_chunked
+
+# Compares the folded trunk pass against one trunk call per view:
+# checks that both give the same trunk features and times them.
+
+BATCH_SIZES = [1, 8, 32]
+NUM_REPEATS = 10
+
+def per_view_trunk(trunk, current_images, goal_image, num_cameras):
+    goal_feat = trunk(goal_image)
+    current_feat = torch.stack([trunk(current_images[:, cam_idx]) for cam_idx in range(num_cameras)], dim=1)
+    return current_feat, goal_feat
+
+def folded_trunk(trunk, current_images, goal_image, num_cameras, chunk_size=None):
+    images = fold_views(current_images[:, :num_cameras], goal_image)
+    return unfold_views(run_chunked(trunk, images, chunk_size), current_images.size(0))
+
+def synchronize():
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+
+def time_fn(fn):
+    fn()
+    synchronize()
+    start = time.perf_counter()
+    for _ in range(NUM_REPEATS):
+        fn()
+    synchronize()
+    return (time.perf_counter() - start) / NUM_REPEATS * 1e3
+
+if __name__ == '__main__':
+    DEVICE = 'cuda' if torch.cuda.is_available() else 'cpu'
+    model = SharedResNet18MLP5().to(DEVICE).eval()
+    trunk, num_cameras = model.shared_trunk, model.num_cameras
+
+    with torch.no_grad():
+        for batch_size in BATCH_SIZES:
+            current_images = torch.randn(batch_size, 5, 3, 224, 224, device=DEVICE)
+            goal_image = torch.randn(batch_size, 3, 224, 224, device=DEVICE)
+
+            reference = per_view_trunk(trunk, current_images, goal_image, num_cameras)
+            folded = folded_trunk(trunk, current_images, goal_image, num_cameras)
+            chunked = folded_trunk(trunk, current_images, goal_image, num_cameras, chunk_size=4)
+            for ref, out, out_chunked in zip(reference, folded, chunked):
+                assert torch.allclose(ref, out, atol=1e-4), (ref - out).abs().max()
+                assert torch.allclose(ref, out_chunked, atol=1e-4), (ref - out_chunked).abs().max()
+
+            per_view_ms = time_fn(lambda: per_view_trunk(trunk, current_images, goal_image, num_cameras))
+            folded_ms = time_fn(lambda: folded_trunk(trunk, current_images, goal_image, num_cameras))
+            print(f'Batch {batch_size}: per view {per_view_ms:.1f} ms, folded {folded_ms:.1f} ms, '
+                  f'speedup {per_view_ms / folded_ms:.2f}x')
@@ -0,0 +1,84 @@
+import os
+import time
+import shutil
+import tempfile
+import numpy as np
+from PIL import Image
+from torch.utils.data import DataLoader
+from SPOT_SingleStep_DataLoader import SPOT_SingleStep_DataLoader
+from SPOT_SingleStep_Video_DataLoader import SPOT_SingleStep_Video_DataLoader
+from build_trajectory_videos import write_trajectory_videos
+from trajectory_sampler import TrajectoryChunkBatchSampler
+from batch_transforms import uint8_transforms
+from benchmark_jpeg_draft import SYNTHETIC_SIZE
+
+# Size on disk and loading throughput of per-trajectory videos against the JPEG tree, on a
+# synthetic trajectory whose camera views drift slowly from step to step like a walking robot.
+# Samples are read in TrajectoryChunkBatchSampler order, and the decoded images are compared.
+
+NUM_STEPS = 100
+BATCH_SIZE = 16
+CHUNK_SIZE = 8
+NUM_WORKERS = [0, 4]
+
+def make_synthetic_trajectory(root):
+    rng = np.random.default_rng(0)
+    width, height = SYNTHETIC_SIZE
+    x, y = np.meshgrid(np.linspace(0, 1, width), np.linspace(0, 1, height))
+    phases = rng.uniform(0, 2 * np.pi, (5, 3))
+
+    def save_image(path, phase, shift):
+        img = np.stack([np.sin(8 * (x + shift) + 5 * y + p) for p in phase], axis=-1) * 100 + 128
+        img = np.clip(img + rng.normal(0, 2, img.shape), 0, 255).astype(np.uint8)
+        Image.fromarray(img).save(path, quality=90)
+
+    trajectory_dir = os.path.join(root, 'traj_0')
+    for step in range(NUM_STEPS):
+        step_dir = os.path.join(trajectory_dir, f'{step:03d}')
+        os.makedirs(step_dir)
+        for cam_idx in range(5):
+            save_image(os.path.join(step_dir, f'{cam_idx}.jpg'), phases[cam_idx], step * 0.005)
+    os.makedirs(os.path.join(root, 'Goal_Images'))
+    save_image(os.path.join(root, 'Goal_Images', 'traj_0.jpg'), phases[0], 0)
+    np.save(os.path.join(trajectory_dir, 'labels.npy'), np.zeros((NUM_STEPS, 3)))
+    return root
+
+def dir_bytes(root, extension):
+    return sum(os.path.getsize(os.path.join(dir_path, name)) for dir_path, _, names in os.walk(root)
+               for name in names if name.endswith(extension))
+
+def samples_per_second(dataset, num_workers):
+    sampler = TrajectoryChunkBatchSampler(dataset.goal_indices, BATCH_SIZE, chunk_size=CHUNK_SIZE)
+    dataloader = DataLoader(dataset, batch_sampler=sampler, num_workers=num_workers, collate_fn=dataset.collate_fn)
+    start = time.perf_counter()
+    for _ in dataloader:
+        pass
+    return len(dataset) / (time.perf_counter() - start)
+
+if __name__ == '__main__':
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        dataset_path = make_synthetic_trajectory(os.path.join(tmp_dir, 'dataset'))
+        video_path = os.path.join(tmp_dir, 'videos')
+        write_trajectory_videos(dataset_path, video_path)
+
+        jpeg_bytes, video_bytes = dir_bytes(dataset_path, '.jpg'), dir_bytes(video_path, '.mp4')
+        print(f'{NUM_STEPS} steps of 5 {SYNTHETIC_SIZE[0]}x{SYNTHETIC_SIZE[1]} cameras: JPEG {jpeg_bytes / 2**20:.1f} MB, '
+              f'video {video_bytes / 2**20:.1f} MB, {jpeg_bytes / video_bytes:.1f}x smaller')
+
+        datasets = {
+            'jpeg': SPOT_SingleStep_DataLoader(dataset_dirs=dataset_path, transform=uint8_transforms, index_cache=False,
+                                               return_goal_index=True),
+            'video': SPOT_SingleStep_Video_DataLoader(video_path, transform=uint8_transforms, return_goal_index=True,
+                                                      batch_size=BATCH_SIZE, chunk_size=CHUNK_SIZE)
+        }
+
+        diff = np.concatenate([(datasets['jpeg'][idx][0].float() - datasets['video'][idx][0].float()).abs().flatten().numpy()
+                               for idx in range(0, NUM_STEPS, 10)])
+        print(f'Video difference in grey levels: mean {diff.mean():.2f}, max {diff.max():.0f}')
+
+        for num_workers in NUM_WORKERS:
+            throughput = {name: samples_per_second(dataset, num_workers) for name, dataset in datasets.items()}
+            print(f'{num_workers} workers: jpeg {throughput["jpeg"]:.1f} samples/s, video {throughput["video"]:.1f} samples/s')
+    finally:
+        shutil.rmtree(tmp_dir)
@@ -0,0 +1,120 @@
+import os
+import json
+import numpy as np
+import torch
+from torch.utils.data import Dataset, DataLoader
+from PIL import Image
+from SPOT_SingleStep_DataLoader import SPOT_SingleStep_DataLoader
+from SPOT_SingleStep_Discredtized_DataLoader import SPOT_SingleStep_Discretized_DataLoader
+
+# Decode and resize every image of a dataset dir once, into uint8 memory-mapped shards
+# read by SPOT_SingleStep_Shard_DataLoader. Dataset dirs already converted are skipped.
+#
+# <IMAGE_SHARD_DIR>/<dataset name>/
+#     steps_XXXXX.npy             uint8 (SHARD_SIZE, 5, 3, 224, 224) current images
+#     goals.npy                   uint8 (num_goals, 3, 224, 224), one per distinct goal image
+#     goal_index.npy              int64 (num_samples,) row of goals.npy of every sample
+#     labels.npy                  float32 (num_samples, 3)
+#     discretized_labels.npy      int64 (num_samples, 3), if the dataset has discretized labels
+#     meta.json                   written last, marks the dataset dir as converted
+
+DATASET_NAMES = ['map01_01a', 'map01_01b', 'map01_02a', 'map01_02b', 'map01_03a', 'map01_03b']
+DATASET_DIR = '/data/lee04484/SPOT_Real_World_Dataset/cleanup_dataset/'
+IMAGE_SHARD_DIR = '/data/lee04484/SPOT_Real_World_Dataset/image_shards/'
+
+IMAGE_SIZE = 224
+SHARD_SIZE = 1024   # Samples per shard (~770MB of uint8 images)
+BATCH_SIZE = 64
+
+def decode_image(image_path, image_size=IMAGE_SIZE):
+    # Same as transforms.Resize((image_size, image_size)) on the PIL image, kept as uint8 (3, H, W)
+    img = Image.open(image_path).convert('RGB').resize((image_size, image_size), Image.BILINEAR)
+    return np.asarray(img).transpose(2, 0, 1)
+
+class ImageStackDataset(Dataset):
+    # Decodes a list of image path lists, one uint8 (len(paths), 3, H, W) stack per item
+    def __init__(self, image_paths, image_size=IMAGE_SIZE):
+        self.image_paths = image_paths
+        self.image_size = image_size
+
+    def __len__(self):
+        return len(self.image_paths)
+
+    def __getitem__(self, idx):
+        return torch.from_numpy(np.stack([decode_image(path, self.image_size) for path in self.image_paths[idx]]))
+
+def decode_into(array, image_paths, num_workers):
+    # Fills array[i] with the decoded images of image_paths[i], decoding in DataLoader workers
+    dataloader = DataLoader(ImageStackDataset(image_paths), batch_size=BATCH_SIZE, num_workers=num_workers)
+    row = 0
+    for images in dataloader:
+        array[row:row + images.size(0)] = images.numpy().reshape(-1, *array.shape[1:])
+        row += images.size(0)
+
+def write_image_shards(dataset_dir, output_dir, num_workers=8):
+    meta_path = os.path.join(output_dir, 'meta.json')
+    if os.path.exists(meta_path):
+        print(f'{output_dir} already converted')
+        return
+    os.makedirs(output_dir, exist_ok=True)
+
+    dataset = SPOT_SingleStep_DataLoader(dataset_dirs=dataset_dir)
+    num_samples = len(dataset)
+
+    # Labels
+    np.save(os.path.join(output_dir, 'labels.npy'), dataset.labels.numpy())
+    try:
+        discretized_dataset = SPOT_SingleStep_Discretized_DataLoader(dataset_dirs=dataset_dir)
+        np.save(os.path.join(output_dir, 'discretized_labels.npy'), discretized_dataset.labels.numpy())
+        has_discretized_labels = True
+    except FileNotFoundError:
+        has_discretized_labels = False
+
+    # Goal images, every trajectory shares one
+    goal_paths = dataset.goal_image_paths
+    goal_index = np.array(dataset.goal_indices, dtype=np.int64)
+    np.save(os.path.join(output_dir, 'goal_index.npy'), goal_index)
+
+    goals = np.lib.format.open_memmap(os.path.join(output_dir, 'goals.npy'), mode='w+', dtype=np.uint8,
+                                      shape=(len(goal_paths), 3, IMAGE_SIZE, IMAGE_SIZE))
+    decode_into(goals, [[path] for path in goal_paths], num_workers)
+    goals.flush()
+    del goals
+
+    # Current images
+    num_shards = (num_samples + SHARD_SIZE - 1) // SHARD_SIZE
+    for shard_id in range(num_shards):
+        start, end = shard_id * SHARD_SIZE, min((shard_id + 1) * SHARD_SIZE, num_samples)
+        steps = np.lib.format.open_memmap(os.path.join(output_dir, f'steps_{shard_id:05d}.npy'), mode='w+', dtype=np.uint8,
+                                          shape=(end - start, 5, 3, IMAGE_SIZE, IMAGE_SIZE))
+        decode_into(steps, [dataset.step_image_paths(idx) for idx in range(start, end)], num_workers)
+        steps.flush()
+        del steps
+        print(f'{os.path.basename(output_dir)}: {end}/{num_samples}')
+
+    # Marks the conversion as complete
+    meta = {
+        'dataset_dir': os.path.abspath(dataset_dir),
+        'image_size': IMAGE_SIZE,
+        'num_samples': num_samples,
+        'num_goals': len(goal_paths),
+        'shard_size': SHARD_SIZE,
+        'num_shards': num_shards,
+        'discretized_labels': has_discretized_labels
+    }
+    tmp_path = meta_path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(meta, f)
+    os.replace(tmp_path, meta_path)
+
+if __name__ == '__main__':
+
+    for dataset_name in DATASET_NAMES:
+        dataset_path = os.path.join(DATASET_DIR, f'{dataset_name}')
+        if not os.path.exists(dataset_path):
+            print(f'Dataset {dataset_name} does not exist!')
+            exit()
+
+        write_image_shards(dataset_path, os.path.join(IMAGE_SHARD_DIR, dataset_name))
+
+    print('Finished Conversion !')
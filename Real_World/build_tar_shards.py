@@ -0,0 +1,110 @@
+import io
+import os
+import json
+import tarfile
+import numpy as np
+from SPOT_SingleStep_DataLoader import SPOT_SingleStep_DataLoader
+from SPOT_SingleStep_Discredtized_DataLoader import SPOT_SingleStep_Discretized_DataLoader
+
+# Pack the encoded JPEGs of a dataset dir, as they are on disk, into large tar shards read
+# sequentially by SPOT_SingleStep_Tar_DataLoader. Dataset dirs already packed are skipped.
+#
+# <TAR_SHARD_DIR>/<dataset name>/
+#     shard_XXXXX.tar             ~SHARD_BYTES of records in trajectory order, one per sample:
+#         traj_XXX/YYY.0.jpg ... traj_XXX/YYY.4.jpg     the five camera images
+#         traj_XXX/YYY.goal.json                        {"goal": row of goals.tar}
+#         traj_XXX/YYY.labels.npy                       float32 (3,)
+#         traj_XXX/YYY.discretized_labels.npy           int64 (3,), if the dataset has discretized labels
+#     goals.tar                   traj_XXX.jpg, one per distinct goal image, in goal index order
+#     meta.json                   written last, marks the dataset dir as packed
+
+DATASET_NAMES = ['map01_01a', 'map01_01b', 'map01_02a', 'map01_02b', 'map01_03a', 'map01_03b']
+DATASET_DIR = '/data/lee04484/SPOT_Real_World_Dataset/cleanup_dataset/'
+TAR_SHARD_DIR = '/data/lee04484/SPOT_Real_World_Dataset/tar_shards/'
+
+SHARD_BYTES = 1 << 30   # Shards close after the record that passes 1GB
+
+def add_bytes(tar, name, data):
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    tar.addfile(info, io.BytesIO(data))
+
+def npy_bytes(array):
+    buffer = io.BytesIO()
+    np.save(buffer, array)
+    return buffer.getvalue()
+
+def read_bytes(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+def write_tar_shards(dataset_dir, output_dir, shard_bytes=SHARD_BYTES):
+    meta_path = os.path.join(output_dir, 'meta.json')
+    if os.path.exists(meta_path):
+        print(f'{output_dir} already packed')
+        return
+    os.makedirs(output_dir, exist_ok=True)
+
+    dataset = SPOT_SingleStep_DataLoader(dataset_dirs=dataset_dir)
+    num_samples = len(dataset)
+
+    # Labels
+    labels = dataset.labels.numpy()
+    try:
+        discretized_labels = SPOT_SingleStep_Discretized_DataLoader(dataset_dirs=dataset_dir).labels.numpy()
+    except FileNotFoundError:
+        discretized_labels = None
+
+    # Goal images, every trajectory shares one
+    goal_paths = dataset.goal_image_paths
+    with tarfile.open(os.path.join(output_dir, 'goals.tar'), 'w') as tar:
+        for goal_path in goal_paths:
+            add_bytes(tar, os.path.basename(goal_path), read_bytes(goal_path))
+
+    # Records, written in dataset order so every shard holds consecutive trajectories
+    shards = []
+    tar = None
+    for idx in range(num_samples):
+        if tar is None:
+            shard_name = f'shard_{len(shards):05d}.tar'
+            tar = tarfile.open(os.path.join(output_dir, shard_name), 'w')
+            shards.append({'name': shard_name, 'num_samples': 0})
+
+        key = f'{dataset.traj_names[dataset.sample_traj[idx]].decode()}/{dataset.sample_step[idx].decode()}'
+        for cam_idx, img_path in enumerate(dataset.step_image_paths(idx)):
+            add_bytes(tar, f'{key}.{cam_idx}.jpg', read_bytes(img_path))
+        add_bytes(tar, f'{key}.goal.json', json.dumps({'goal': int(dataset.goal_indices[idx])}).encode())
+        add_bytes(tar, f'{key}.labels.npy', npy_bytes(labels[idx]))
+        if discretized_labels is not None:
+            add_bytes(tar, f'{key}.discretized_labels.npy', npy_bytes(discretized_labels[idx]))
+        shards[-1]['num_samples'] += 1
+
+        if tar.fileobj.tell() >= shard_bytes or idx == num_samples - 1:
+            tar.close()
+            tar = None
+            print(f'{os.path.basename(output_dir)}: {idx + 1}/{num_samples}')
+
+    # Marks the packing as complete
+    meta = {
+        'dataset_dir': os.path.abspath(dataset_dir),
+        'num_samples': num_samples,
+        'num_goals': len(goal_paths),
+        'shards': shards,
+        'discretized_labels': discretized_labels is not None
+    }
+    tmp_path = meta_path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(meta, f)
+    os.replace(tmp_path, meta_path)
+
+if __name__ == '__main__':
+
+    for dataset_name in DATASET_NAMES:
+        dataset_path = os.path.join(DATASET_DIR, f'{dataset_name}')
+        if not os.path.exists(dataset_path):
+            print(f'Dataset {dataset_name} does not exist!')
+            exit()
+
+        write_tar_shards(dataset_path, os.path.join(TAR_SHARD_DIR, dataset_name))
+
+    print('Finished Packing !')
@@ -0,0 +1,95 @@
+import os
+import json
+import shutil
+import numpy as np
+from PIL import Image
+import av
+from SPOT_SingleStep_DataLoader import SPOT_SingleStep_DataLoader
+
+# Encode every camera of every trajectory of a dataset dir as one H.264 video, read by
+# SPOT_SingleStep_Video_DataLoader. Consecutive steps are near-identical frames, which the
+# video codec stores as small differences. Dataset dirs already converted are skipped.
+#
+# <VIDEO_DIR>/<dataset name>/
+#     traj_XXX/0.mp4 ... 4.mp4              one frame per step, in step order
+#     traj_XXX/labels.npy                   copied, and discretized_labels.npy if it exists
+#     Goal_Images/traj_XXX.jpg              copied
+#     meta.json                             written last, marks the dataset dir as converted
+
+DATASET_NAMES = ['map01_01a', 'map01_01b', 'map01_02a', 'map01_02b', 'map01_03a', 'map01_03b']
+DATASET_DIR = '/data/lee04484/SPOT_Real_World_Dataset/cleanup_dataset/'
+VIDEO_DIR = '/data/lee04484/SPOT_Real_World_Dataset/trajectory_videos/'
+
+FPS = 10
+CRF = 18          # x264 quality, 18 is close to visually lossless
+GOP_SIZE = 16     # Frames between keyframes, a seek decodes at most this many frames
+
+def write_camera_video(output_path, image_paths):
+    with av.open(output_path, mode='w') as container:
+        stream = None
+        for image_path in image_paths:
+            img = Image.open(image_path).convert('RGB')
+            if stream is None:
+                stream = container.add_stream('libx264', rate=FPS, options={'crf': str(CRF), 'g': str(GOP_SIZE)})
+                # yuv420p needs even dimensions
+                stream.width, stream.height = img.width // 2 * 2, img.height // 2 * 2
+                stream.pix_fmt = 'yuv420p'
+            frame = av.VideoFrame.from_image(img).reformat(width=stream.width, height=stream.height, format='yuv420p')
+            for packet in stream.encode(frame):
+                container.mux(packet)
+        for packet in stream.encode():
+            container.mux(packet)
+
+def write_trajectory_videos(dataset_dir, output_dir):
+    meta_path = os.path.join(output_dir, 'meta.json')
+    if os.path.exists(meta_path):
+        print(f'{output_dir} already converted')
+        return
+    os.makedirs(os.path.join(output_dir, 'Goal_Images'), exist_ok=True)
+
+    dataset = SPOT_SingleStep_DataLoader(dataset_dirs=dataset_dir)
+    trajectories = []
+    for traj, traj_name in enumerate(dataset.traj_names):
+        traj_name = traj_name.decode()
+        samples = np.flatnonzero(dataset.sample_traj == traj)
+        os.makedirs(os.path.join(output_dir, traj_name), exist_ok=True)
+
+        # A trajectory without steps has no frame to size the videos from and is never read, it only
+        # keeps its goal so the goal indices match the JPEG tree
+        step_image_paths = [dataset.step_image_paths(idx) for idx in samples]
+        for cam_idx in range(5 if len(samples) else 0):
+            write_camera_video(os.path.join(output_dir, traj_name, f'{cam_idx}.mp4'), [paths[cam_idx] for paths in step_image_paths])
+
+        for label_file in ['labels.npy', 'discretized_labels.npy']:
+            label_path = os.path.join(dataset.trajectory_dir(traj), label_file)
+            if os.path.exists(label_path):
+                shutil.copyfile(label_path, os.path.join(output_dir, traj_name, label_file))
+        shutil.copyfile(dataset.goal_image_path(traj), os.path.join(output_dir, 'Goal_Images', f'{traj_name}.jpg'))
+
+        trajectories.append({'name': traj_name, 'steps': [step.decode() for step in dataset.sample_step[samples]]})
+        print(f'{os.path.basename(output_dir)}: {traj + 1}/{len(dataset.traj_names)} trajectories')
+
+    # Marks the conversion as complete
+    meta = {
+        'dataset_dir': os.path.abspath(dataset_dir),
+        'fps': FPS,
+        'crf': CRF,
+        'gop_size': GOP_SIZE,
+        'trajectories': trajectories
+    }
+    tmp_path = meta_path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(meta, f)
+    os.replace(tmp_path, meta_path)
+
+if __name__ == '__main__':
+
+    for dataset_name in DATASET_NAMES:
+        dataset_path = os.path.join(DATASET_DIR, f'{dataset_name}')
+        if not os.path.exists(dataset_path):
+            print(f'Dataset {dataset_name} does not exist!')
+            exit()
+
+        write_trajectory_videos(dataset_path, os.path.join(VIDEO_DIR, dataset_name))
+
+    print('Finished Conversion !')
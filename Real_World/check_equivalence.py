@@ -0,0 +1,235 @@
+import torch
+import torch.nn as nn
+from models.grouped_heads import GroupedConvHeads, sequential_on_tokens
+from models.cross_attention import CrossAttentionBlock, BidirectionalCrossAttention
+from models.DinoMLP5 import SharedDinoMLP5
+from models.DinoMLP5_discretized import DinoMLP5_discretized
+from models.DinoCnn2MLP3 import DinoCnn2MLP3
+from models.trunk_batching import unique_goals
+from torchvision import transforms
+from batch_transforms import BatchNormalize, IMAGENET_MEAN, IMAGENET_STD
+from metrics import ToleranceAccuracy, DiscretizedAccuracy
+
+# Checks that the fused, token-major model components compute the same as the
+# per-camera NCHW modules they replace, and stay checkpoint compatible with them.
+
+NUM_CAMERAS = 5
+GRID_SIZE = (16, 16)
+ATOL = 1e-5
+
+class LegacyCrossAttentionBlock(nn.Module):
+    # The CrossAttentionBlock the models were trained with, seq-first nn.MultiheadAttention on NCHW
+    def __init__(self, embed_dim, num_heads=8):
+        super(LegacyCrossAttentionBlock, self).__init__()
+        self.mha = nn.MultiheadAttention(embed_dim, num_heads)
+
+    def forward(self, query, key_value):
+        # query and key_value: (B, C, H, W)
+        B, C, H, W = query.shape
+
+        # (H*W, B, C)
+        query_flat = query.view(B, C, -1).permute(2, 0, 1)
+        key_value_flat = key_value.view(B, C, -1).permute(2, 0, 1)
+        attn_output, _ = self.mha(query_flat, key_value_flat, key_value_flat)
+
+        # (B, C, H, W)
+        attn_output = attn_output.permute(1, 2, 0).view(B, C, H, W)
+        return attn_output
+
+def to_tokens(feat):
+    # (B, C, H, W) -> (B, N, C), (B, V, C, H, W) -> camera-major (V, B, N, C)
+    if feat.dim() == 4:
+        return feat.flatten(2).transpose(1, 2)
+    return feat.flatten(3).permute(1, 0, 3, 2)
+
+def assert_close(output, reference):
+    assert torch.allclose(output, reference, atol=ATOL), (output - reference).abs().max()
+
+def conv_head(channels, kernel_size, padding):
+    return nn.Sequential(
+        *[nn.Conv2d(in_channels, out_channels, kernel_size=kernel_size, padding=padding)
+          for in_channels, out_channels in zip(channels[:-1], channels[1:])],
+        nn.ReLU(inplace=True)
+    )
+
+def check_grouped_heads(channels, kernel_size, padding):
+    heads = nn.ModuleList([conv_head(channels, kernel_size, padding) for _ in range(NUM_CAMERAS)])
+    fused = GroupedConvHeads.from_module_list(heads, kernel_size=kernel_size, padding=padding)
+
+    # Same keys and values in both directions
+    heads_state_dict = heads.state_dict()
+    assert list(fused.state_dict().keys()) == list(heads_state_dict.keys())
+    for key, value in fused.to_module_list().state_dict().items():
+        assert torch.equal(value, heads_state_dict[key]), key
+
+    with torch.no_grad():
+        # Per-camera inputs
+        x = torch.randn(2, NUM_CAMERAS, channels[0], *GRID_SIZE)
+        reference = torch.stack([heads[cam_idx](x[:, cam_idx]) for cam_idx in range(NUM_CAMERAS)], dim=1)
+        assert_close(fused(to_tokens(x), grid_size=GRID_SIZE), to_tokens(reference))
+
+        # One input shared by every camera, as for the goal image
+        goal = torch.randn(2, channels[0], *GRID_SIZE)
+        reference = torch.stack([heads[cam_idx](goal) for cam_idx in range(NUM_CAMERAS)], dim=1)
+        assert_close(fused(to_tokens(goal), grid_size=GRID_SIZE), to_tokens(reference))
+
+    print(f'GroupedConvHeads {channels} kernel {kernel_size}: OK')
+
+def check_sequential_on_tokens(channels, kernel_size, padding):
+    head = conv_head(channels, kernel_size, padding)
+    with torch.no_grad():
+        x = torch.randn(2, channels[0], *GRID_SIZE)
+        assert_close(sequential_on_tokens(head, to_tokens(x), GRID_SIZE), to_tokens(head(x)))
+
+    print(f'sequential_on_tokens {channels} kernel {kernel_size}: OK')
+
+def check_cross_attention_block(embed_dim):
+    legacy = LegacyCrossAttentionBlock(embed_dim, num_heads=8).eval()
+    block = CrossAttentionBlock(embed_dim, num_heads=8).eval()
+    block.load_state_dict(legacy.state_dict())
+    assert list(block.state_dict().keys()) == list(legacy.state_dict().keys())
+
+    with torch.no_grad():
+        query = torch.randn(2, embed_dim, *GRID_SIZE)
+        key_value = torch.randn(2, embed_dim, *GRID_SIZE)
+        assert_close(block(to_tokens(query), to_tokens(key_value)), to_tokens(legacy(query, key_value)))
+
+    print(f'CrossAttentionBlock {embed_dim}: OK')
+
+def check_bidirectional_attention(embed_dim, shared_goal):
+    block = LegacyCrossAttentionBlock(embed_dim, num_heads=8).eval()
+    batched = BidirectionalCrossAttention(embed_dim, num_heads=8).eval()
+    batched.load_state_dict(block.state_dict())
+
+    with torch.no_grad():
+        current_feats = torch.randn(2, NUM_CAMERAS, embed_dim, *GRID_SIZE)
+        if shared_goal:
+            goal_feats = torch.randn(2, embed_dim, *GRID_SIZE)
+            goal_per_camera = [goal_feats] * NUM_CAMERAS
+        else:
+            goal_feats = torch.randn(2, NUM_CAMERAS, embed_dim, *GRID_SIZE)
+            goal_per_camera = [goal_feats[:, cam_idx].contiguous() for cam_idx in range(NUM_CAMERAS)]
+
+        curr_cross, goal_cross = batched(to_tokens(current_feats), to_tokens(goal_feats))
+        for cam_idx in range(NUM_CAMERAS):
+            curr_feat = current_feats[:, cam_idx].contiguous()
+            assert_close(curr_cross[cam_idx], to_tokens(block(curr_feat, goal_per_camera[cam_idx])))
+            assert_close(goal_cross[cam_idx], to_tokens(block(goal_per_camera[cam_idx], curr_feat)))
+
+    print(f'BidirectionalCrossAttention {embed_dim} shared goal {shared_goal}: OK')
+
+def check_unique_goals(model_cls):
+    # Unique goals with goal_inverse_index against one goal per sample: same outputs and gradients
+    model = model_cls(load_trunk=False).eval()
+    current_tokens = torch.randn(6, NUM_CAMERAS, 256, 384)
+    unique_goal_tokens = torch.randn(2, 256, 384)
+    goal_inverse_index = torch.tensor([0, 1, 1, 0, 1, 0])
+
+    outputs, grads = [], []
+    for goal_tokens, inverse_index in [(unique_goal_tokens[goal_inverse_index], None),
+                                       (unique_goal_tokens, goal_inverse_index)]:
+        model.zero_grad()
+        output = model.forward_tokens(current_tokens, goal_tokens, inverse_index)
+        output.square().sum().backward()
+        outputs.append(output.detach())
+        grads.append([param.grad.clone() for param in model.goal_heads.parameters()])
+
+    assert_close(outputs[1], outputs[0])
+    for grad, reference in zip(*grads[::-1]):
+        assert torch.allclose(grad, reference, atol=1e-4), (grad - reference).abs().max()
+
+    # DataParallel scatter: one goal per sample with its goal id, every replica dedups its own goals.
+    # Splitting the unique goals and goal_inverse_index independently fails the index assert
+    with torch.no_grad():
+        goal_tokens = unique_goal_tokens[goal_inverse_index]
+        scattered = torch.cat([model(current_tokens[rows], goal_tokens[rows], None, goal_inverse_index[rows])
+                               for rows in [slice(0, 3), slice(3, 6)]])
+        assert_close(scattered, outputs[0])
+        deduped_goals, deduped_inverse_index = unique_goals(goal_tokens, goal_inverse_index)
+        assert torch.equal(deduped_goals, unique_goal_tokens) and torch.equal(deduped_inverse_index, goal_inverse_index)
+        try:
+            model.forward_tokens(current_tokens[3:], unique_goal_tokens[1:], goal_inverse_index[3:])
+            raise RuntimeError('split goal_inverse_index was not caught')
+        except AssertionError:
+            pass
+
+    print(f'{model_cls.__name__} unique goals: OK')
+
+def check_trunk_state(model_cls):
+    # Checkpoints without the trunk and with it load into either model, a small module stands in for the trunk
+    heads_only = model_cls(load_trunk=False)
+    full = model_cls(load_trunk=False)
+    full.shared_trunk = nn.Linear(4, 4)
+    trunk_weight = full.shared_trunk.weight.detach().clone()
+    assert list(full.state_dict().keys()) == list(heads_only.state_dict().keys())
+    assert not any(key.startswith('shared_trunk.') for key in full.state_dict())
+
+    full.load_state_dict(heads_only.state_dict())
+    heads_only.load_state_dict(full.state_dict())
+    # Full checkpoints saved with the trunk
+    legacy_state_dict = dict(full.state_dict(), **{'shared_trunk.' + key: torch.zeros_like(value)
+                                                   for key, value in full.shared_trunk.state_dict().items()})
+    heads_only.load_state_dict(legacy_state_dict)
+    full.load_state_dict(legacy_state_dict)
+    assert torch.equal(full.shared_trunk.weight, trunk_weight)
+
+    print(f'{model_cls.__name__} trunk state: OK')
+
+def check_batch_normalize():
+    # uint8 batch normalised on device against ToTensor + Normalize per image
+    images = torch.randint(0, 256, (2, NUM_CAMERAS, 3, *GRID_SIZE), dtype=torch.uint8)
+    normalize = transforms.Normalize(IMAGENET_MEAN, IMAGENET_STD)
+    reference = torch.stack([torch.stack([normalize(img.float() / 255) for img in step]) for step in images])
+    assert_close(BatchNormalize()(images), reference)
+    assert_close(BatchNormalize()(images[:, 0]), reference[:, 0])
+
+    print('BatchNormalize: OK')
+
+def check_metrics(tolerance=0.5):
+    # Batched metrics against the per-element loops they replace
+    outputs = [torch.rand(16, 3) for _ in range(3)]
+    labels = [torch.rand(16, 3) for _ in range(3)]
+    metric = ToleranceAccuracy(tolerance)
+    num_correct, num_total = 0, 0
+    for output, label in zip(outputs, labels):
+        metric.update(output, label)
+        for i in range(output.shape[0]):
+            loss = 0
+            for j in range(output.shape[1]):
+                loss += abs(output[i][j] - label[i][j]).item()
+            num_total += 1
+            if loss < tolerance:
+                num_correct += 1
+    results = metric.compute()
+    assert abs(results['accuracy'] - num_correct / num_total * 100) < 1e-9
+    assert_close(torch.tensor(results['mae'], dtype=torch.float64), (torch.cat(outputs) - torch.cat(labels)).abs().mean(dim=0).double())
+
+    logits, classes = torch.randn(32, 3, 5), torch.randint(0, 5, (32, 3))
+    classes[:8] = torch.argmax(logits[:8], dim=2)
+    metric = DiscretizedAccuracy()
+    metric.update(logits, classes)
+    results = metric.compute()
+    correct = torch.argmax(logits, dim=2) == classes
+    assert abs(results['accuracy'] - torch.all(correct, dim=1).sum().item() / 32 * 100) < 1e-9
+    assert_close(torch.tensor(results['axis_accuracy'], dtype=torch.float64), correct.double().mean(dim=0) * 100)
+
+    print('Metrics: OK')
+
+if __name__ == '__main__':
+    torch.manual_seed(0)
+    check_grouped_heads([384, 384], kernel_size=1, padding=0)
+    check_grouped_heads([384, 384, 768], kernel_size=3, padding=1)
+    check_grouped_heads([512, 512], kernel_size=1, padding=0)
+    check_sequential_on_tokens([384, 384], kernel_size=1, padding=0)
+    check_sequential_on_tokens([384, 384, 768], kernel_size=3, padding=1)
+    check_cross_attention_block(384)
+    check_cross_attention_block(768)
+    check_bidirectional_attention(384, shared_goal=False)
+    check_bidirectional_attention(768, shared_goal=True)
+    check_unique_goals(SharedDinoMLP5)
+    check_unique_goals(DinoMLP5_discretized)
+    check_unique_goals(DinoCnn2MLP3)
+    check_trunk_state(SharedDinoMLP5)
+    check_trunk_state(DinoCnn2MLP3)
+    check_batch_normalize()
+    check_metrics()
@@ -0,0 +1,86 @@
+import os
+import shutil
+import tempfile
+import numpy as np
+from PIL import Image
+from torch.utils.data import DataLoader
+from SPOT_SingleStep_Stream_DataLoader import SPOT_SingleStep_Stream_DataLoader
+from batch_transforms import uint8_transforms
+
+# Checks of the streaming dataset on a small synthetic dataset whose labels identify
+# their (trajectory, step): a single process reads every sample once per epoch, DDP ranks
+# read disjoint samples in the same number of batches, epochs are reshuffled, and resume()
+# continues an epoch where it stopped.
+
+NUM_TRAJECTORIES = 12
+MAX_STEPS = 20
+WORLD_SIZE = 2
+NUM_WORKERS = 2
+BATCH_SIZE = 4
+SHUFFLE_BUFFER_SIZE = 16
+
+def make_dataset(root):
+    rng = np.random.default_rng(0)
+    os.makedirs(os.path.join(root, 'Goal_Images'))
+    img = Image.fromarray(np.zeros((32, 32, 3), dtype=np.uint8))
+    for traj_idx in range(NUM_TRAJECTORIES):
+        num_steps = int(rng.integers(5, MAX_STEPS))
+        trajectory_dir = os.path.join(root, f'traj_{traj_idx}')
+        for step in range(num_steps):
+            os.makedirs(os.path.join(trajectory_dir, f'{step:03d}'))
+            for cam_idx in range(5):
+                img.save(os.path.join(trajectory_dir, f'{step:03d}', f'{cam_idx}.jpg'))
+        img.save(os.path.join(root, 'Goal_Images', f'traj_{traj_idx}.jpg'))
+        np.save(os.path.join(trajectory_dir, 'labels.npy'), np.array([[traj_idx, step, 0] for step in range(num_steps)]))
+    return root
+
+def sample_ids(dataset, num_batches=None, return_num_batches=False):
+    dataloader = DataLoader(dataset, batch_size=BATCH_SIZE, num_workers=NUM_WORKERS)
+    ids, batch_idx = [], 0
+    for batch_idx, (_, _, labels) in enumerate(dataloader):
+        if batch_idx == num_batches:
+            break
+        ids.extend((int(traj_idx), int(step)) for traj_idx, step, _ in labels)
+    if return_num_batches:
+        return ids, batch_idx + 1
+    return ids
+
+if __name__ == '__main__':
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        dataset_path = make_dataset(tmp_dir)
+        datasets = [SPOT_SingleStep_Stream_DataLoader(dataset_path, transform=uint8_transforms, shuffle_buffer_size=SHUFFLE_BUFFER_SIZE,
+                                                      rank=rank, world_size=WORLD_SIZE) for rank in range(WORLD_SIZE)]
+        num_samples = sum(len(os.listdir(os.path.join(dataset_path, f'traj_{traj_idx}'))) - 1 for traj_idx in range(NUM_TRAJECTORIES))
+
+        single = SPOT_SingleStep_Stream_DataLoader(dataset_path, transform=uint8_transforms, shuffle_buffer_size=SHUFFLE_BUFFER_SIZE,
+                                                   rank=0, world_size=1)
+        single_ids = sample_ids(single)
+        assert len(single_ids) == len(set(single_ids)) == num_samples, (len(single_ids), len(set(single_ids)), num_samples)
+        print(f'Single process: {num_samples} samples, each once')
+
+        epochs = []
+        for epoch in range(2):
+            for dataset in datasets:
+                dataset.set_epoch(epoch)
+            epoch_ids, epoch_batches = zip(*[sample_ids(dataset, return_num_batches=True) for dataset in datasets])
+            all_ids = epoch_ids[0] + epoch_ids[1]
+            assert len(all_ids) == len(set(all_ids)), (len(all_ids), len(set(all_ids)))
+            # Readers are balanced to within a trajectory, the ones ahead drop the rest
+            assert num_samples - len(all_ids) < WORLD_SIZE * NUM_WORKERS * MAX_STEPS, (len(all_ids), num_samples)
+            assert len(set(len(ids) for ids in epoch_ids)) == 1 and len(set(epoch_batches)) == 1, (epoch_ids, epoch_batches)
+            epochs.append(epoch_ids[0])
+            print(f'Epoch {epoch}: {len(all_ids)} of {num_samples} samples, rank sizes {[len(ids) for ids in epoch_ids]}, '
+                  f'{epoch_batches[0]} batches per rank, no overlap')
+        assert epochs[0] != epochs[1]
+
+        for num_batches in [1, 3, 6]:
+            datasets[0].set_epoch(1)
+            full = sample_ids(datasets[0])
+            datasets[0].resume(1, num_batches, BATCH_SIZE, NUM_WORKERS)
+            resumed = sample_ids(datasets[0])
+            # Workers take turns in a different order after the resume, the remaining samples are the same
+            assert sorted(full[num_batches * BATCH_SIZE:]) == sorted(resumed), num_batches
+        print('Resume continues the epoch where it stopped, without repeated samples')
+    finally:
+        shutil.rmtree(tmp_dir)
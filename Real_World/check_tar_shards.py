@@ -0,0 +1,45 @@
+import os
+import shutil
+import tempfile
+import torch
+from torch.utils.data import DataLoader
+from SPOT_SingleStep_DataLoader import SPOT_SingleStep_DataLoader
+from SPOT_SingleStep_Tar_DataLoader import SPOT_SingleStep_Tar_DataLoader
+from build_tar_shards import write_tar_shards
+from batch_transforms import uint8_transforms
+from check_stream_dataset import make_dataset
+
+# Packs a small synthetic dataset into tar shards and checks that the tar dataset serves
+# every sample once per epoch, with the same images, goals and labels as SPOT_SingleStep_DataLoader.
+
+SHARD_BYTES = 64 << 10   # Small shards, so the dataset spans several of them
+NUM_WORKERS = 2
+
+if __name__ == '__main__':
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        dataset_path = make_dataset(os.path.join(tmp_dir, 'dataset'))
+        shard_path = os.path.join(tmp_dir, 'tar_shards')
+        write_tar_shards(dataset_path, shard_path, shard_bytes=SHARD_BYTES)
+
+        reference = SPOT_SingleStep_DataLoader(dataset_dirs=dataset_path, transform=uint8_transforms, index_cache=False,
+                                               return_goal_index=True)
+        dataset = SPOT_SingleStep_Tar_DataLoader(shard_path, transform=uint8_transforms, return_goal_index=True,
+                                                 shuffle_buffer_size=8)
+        print(f'{len(reference)} samples in {len(dataset.shards)} shards')
+
+        # Labels of the synthetic dataset are (trajectory, step, 0)
+        reference_idx = {(int(label[0]), int(label[1])): idx for idx, label in enumerate(reference.labels)}
+        seen = set()
+        for step_imgs, goal_idx, label in DataLoader(dataset, batch_size=None, num_workers=NUM_WORKERS):
+            idx = reference_idx[(int(label[0]), int(label[1]))]
+            assert idx not in seen, idx
+            seen.add(idx)
+            assert torch.equal(label, reference.labels[idx])
+            assert goal_idx == reference.goal_indices[idx]
+            assert torch.equal(step_imgs, reference.load_step_images(reference.step_image_paths(idx)))
+        assert len(seen) == len(reference)
+        assert torch.equal(dataset.goal_table(), reference.goal_table())
+        print('Tar shards match the JPEG tree')
+    finally:
+        shutil.rmtree(tmp_dir)
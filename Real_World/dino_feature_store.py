@@ -0,0 +1,181 @@
+import os
+import json
+import glob
+import hashlib
+import numpy as np
+import torch
+
+from models.dino_trunk import DINO_NUM_PATCHES, DINO_EMBED_DIM
+
+SHARD_SIZE = 2048   # Images per shard (~800MB of float32 tokens)
+
+def transform_hash(transform):
+    # torchvision transforms print every parameter in their repr
+    return hashlib.sha1(repr(transform).encode()).hexdigest()[:16]
+
+def path_hash(path):
+    # 64-bit key of an absolute image path
+    return int.from_bytes(hashlib.blake2b(path.encode(), digest_size=8).digest(), 'little')
+
+def _write_json(path, data):
+    # Write-then-rename so an interrupted extraction never leaves a truncated file
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+class DinoFeatureStore:
+    # Memory-mapped DinoV2 x_norm_patchtokens keyed by image path, in <store_dir>/<transform hash>-<trunk hash>/
+    # as .npy shards of (shard_size, 256, 384) tokens, each with a json list of its image paths.
+    # dtype is fixed when the store is created, float16 halves the disk use but the heads then see rounded tokens
+    def __init__(self, store_dir, transform, trunk_hash=None, dtype=np.float32, shard_size=SHARD_SIZE):
+        key = transform_hash(transform)
+        if trunk_hash is None:
+            # Heads-only training does not load the trunk, so pick the store built for this transform
+            candidates = sorted(glob.glob(os.path.join(store_dir, f'{key}-*')))
+            if len(candidates) != 1:
+                raise ValueError(f'Expected exactly one feature store for transform {key} in {store_dir}, '
+                                 f'found {len(candidates)}')
+            self.root = candidates[0]
+        else:
+            self.root = os.path.join(store_dir, f'{key}-{trunk_hash}')
+
+        meta_path = os.path.join(self.root, 'meta.json')
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                meta = json.load(f)
+        else:
+            os.makedirs(self.root, exist_ok=True)
+            meta = {
+                'transform': repr(transform),
+                'trunk_hash': trunk_hash,
+                'dtype': np.dtype(dtype).name,
+                'shard_size': shard_size,
+                'token_shape': [DINO_NUM_PATCHES, DINO_EMBED_DIM]
+            }
+            _write_json(meta_path, meta)
+
+        self.trunk_hash = meta['trunk_hash']
+        self.dtype = np.dtype(meta['dtype'])
+        self.shard_size = meta['shard_size']
+        self.token_shape = tuple(meta['token_shape'])
+
+        # Committed images as path hashes sorted for searchsorted, with their shard and row. Flat arrays
+        # rather than a dict of paths, so forked DataLoader workers share the pages
+        hashes, shards, rows = [], [], []
+        self.num_shards = 0
+        self.last_paths = []   # Paths of the last shard, the one add() appends to
+        while os.path.exists(self._paths_file(self.num_shards)):
+            with open(self._paths_file(self.num_shards)) as f:
+                self.last_paths = json.load(f)
+            hashes.extend(path_hash(path) for path in self.last_paths)
+            shards.append(np.full(len(self.last_paths), self.num_shards, dtype=np.int32))
+            rows.append(np.arange(len(self.last_paths), dtype=np.int32))
+            self.num_shards += 1
+        self.index_hash = np.zeros(0, dtype=np.uint64)
+        self.index_shard = np.zeros(0, dtype=np.int32)
+        self.index_row = np.zeros(0, dtype=np.int32)
+        if hashes:
+            self._merge_index(np.array(hashes, dtype=np.uint64), np.concatenate(shards), np.concatenate(rows))
+
+        # Added since the last flush: path hash -> (shard, row)
+        self._added = {}
+
+        # Memmaps are opened lazily, so every DataLoader worker maps the shards itself
+        self._shards = {}
+        self._dirty = False   # Last shard has rows not committed yet
+
+    def __len__(self):
+        return len(self.index_hash) + len(self._added)
+
+    def __contains__(self, path):
+        return self._lookup(path_hash(os.path.abspath(path))) is not None
+
+    def _merge_index(self, hashes, shards, rows):
+        hashes = np.concatenate([self.index_hash, hashes])
+        order = np.argsort(hashes, kind='stable')
+        self.index_hash = hashes[order]
+        self.index_shard = np.concatenate([self.index_shard, shards])[order]
+        self.index_row = np.concatenate([self.index_row, rows])[order]
+        if np.any(self.index_hash[1:] == self.index_hash[:-1]):
+            raise ValueError(f'Path hash collision in feature store {self.root}')
+
+    def _lookup(self, key):
+        # (shard, row) of a path hash, None if not in the store
+        i = np.searchsorted(self.index_hash, np.uint64(key))
+        if i < len(self.index_hash) and int(self.index_hash[i]) == key:
+            return int(self.index_shard[i]), int(self.index_row[i])
+        return self._added.get(key)
+
+    def __getstate__(self):
+        # Never pickle memmaps into workers, they would be copied
+        state = self.__dict__.copy()
+        state['_shards'] = {}
+        return state
+
+    def _shard_file(self, shard_id):
+        return os.path.join(self.root, f'shard_{shard_id:05d}.npy')
+
+    def _paths_file(self, shard_id):
+        return os.path.join(self.root, f'shard_{shard_id:05d}.json')
+
+    def _shard(self, shard_id, writable=False):
+        shard = self._shards.get(shard_id)
+        if shard is None or (writable and not shard.flags.writeable):
+            shard_file = self._shard_file(shard_id)
+            if writable and not os.path.exists(shard_file):
+                shard = np.lib.format.open_memmap(shard_file, mode='w+', dtype=self.dtype,
+                                                  shape=(self.shard_size,) + self.token_shape)
+            else:
+                shard = np.load(shard_file, mmap_mode='r+' if writable else 'r')
+            self._shards[shard_id] = shard
+        return shard
+
+    def get(self, path):
+        location = self._lookup(path_hash(os.path.abspath(path)))
+        if location is None:
+            raise KeyError(f'{path} is not in feature store {self.root}')
+        shard_id, row = location
+        return self._shard(shard_id)[row]
+
+    def load(self, paths):
+        tokens = np.stack([self.get(path) for path in paths], axis=0)
+        return torch.from_numpy(tokens).to(dtype=torch.float32)
+
+    def add(self, paths, tokens):
+        if isinstance(tokens, torch.Tensor):
+            tokens = tokens.detach().cpu().numpy()
+
+        for path, token in zip(paths, tokens):
+            path = os.path.abspath(path)
+            key = path_hash(path)
+            if self._lookup(key) is not None:
+                continue
+
+            if self.num_shards == 0 or len(self.last_paths) == self.shard_size:
+                # The full shard is committed before its path list is dropped
+                self._commit_last_shard()
+                self.num_shards += 1
+                self.last_paths = []
+            shard_id = self.num_shards - 1
+            row = len(self.last_paths)
+
+            self._shard(shard_id, writable=True)[row] = token.astype(self.dtype)
+            self.last_paths.append(path)
+            self._added[key] = (shard_id, row)
+            self._dirty = True
+
+    def _commit_last_shard(self):
+        # Shard data first, then its path list
+        if self._dirty:
+            self._shards[self.num_shards - 1].flush()
+            _write_json(self._paths_file(self.num_shards - 1), self.last_paths)
+            self._dirty = False
+
+    def flush(self):
+        self._commit_last_shard()
+        if self._added:
+            keys = np.fromiter(self._added.keys(), dtype=np.uint64, count=len(self._added))
+            locations = np.array(list(self._added.values()), dtype=np.int32)
+            self._merge_index(keys, locations[:, 0], locations[:, 1])
+            self._added = {}
@@ -0,0 +1,82 @@
+import torch, os
+import numpy as np
+from torchvision import transforms
+from torch.utils.data import Dataset, DataLoader
+from PIL import Image
+from SPOT_SingleStep_DataLoader import SPOT_SingleStep_DataLoader
+from dino_feature_store import DinoFeatureStore
+from models.dino_trunk import load_dino_trunk, trunk_weights_hash
+
+# Extract DinoV2 patch tokens of every current and goal image once, so that
+# training can run the heads only. Re-running resumes where the last run stopped.
+
+DATASET_NAMES = ['map01_01a', 'map01_01b', 'map01_02a', 'map01_02b', 'map01_03a', 'map01_03b']
+DATASET_DIR = '/data/lee04484/SPOT_Real_World_Dataset/cleanup_dataset/'
+FEATURE_STORE_DIR = '/data/lee04484/SPOT_Real_World_Dataset/dino_features/'
+
+BATCH_SIZE = 256
+FLUSH_STEP = 20   # Batches between commits to disk
+# Token dtype of a new store. float16 halves the disk and page cache use, but heads-only training
+# then sees rounded tokens and is no longer numerically identical to running the trunk
+FEATURE_DTYPE = np.float32
+
+# Must match the transform of the training script
+data_transforms = transforms.Compose([
+    transforms.Resize((224, 224)),
+    transforms.ToTensor(),
+    transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])
+])
+
+class ImagePathDataset(Dataset):
+    def __init__(self, image_paths, transform):
+        self.image_paths = image_paths
+        self.transform = transform
+
+    def __len__(self):
+        return len(self.image_paths)
+
+    def __getitem__(self, idx):
+        img = self.transform(Image.open(self.image_paths[idx]))
+        return img, self.image_paths[idx]
+
+if __name__ == '__main__':
+
+    # Setup Dataset Path
+    DATASET_PATHS = []
+    for dataset_name in DATASET_NAMES:
+        dataset_path = os.path.join(DATASET_DIR, f'{dataset_name}')
+        if not os.path.exists(dataset_path):
+            print(f'Dataset {dataset_name} does not exist!')
+            exit()
+        DATASET_PATHS.append(dataset_path)
+
+    DEVICE = 'cuda' if torch.cuda.is_available() else 'cpu'
+    trunk = load_dino_trunk().to(DEVICE)
+    store = DinoFeatureStore(FEATURE_STORE_DIR, data_transforms, trunk_hash=trunk_weights_hash(trunk), dtype=FEATURE_DTYPE)
+    if store.dtype != np.dtype(FEATURE_DTYPE):
+        print(f'Feature store {store.root} already holds {store.dtype.name} tokens, not {np.dtype(FEATURE_DTYPE).name}')
+        exit()
+    print(f'Feature store: {store.root}, {len(store)} images already extracted')
+
+    # Every distinct image of the datasets that is not in the store yet
+    dataset = SPOT_SingleStep_DataLoader(dataset_dirs=DATASET_PATHS)
+    image_paths = []
+    for idx in range(len(dataset)):
+        image_paths.extend(dataset.step_image_paths(idx))
+    image_paths.extend(dataset.goal_image_paths)
+    image_paths = [path for path in dict.fromkeys(image_paths) if path not in store]
+    print(f'{len(image_paths)} images to extract')
+
+    dataloader = DataLoader(ImagePathDataset(image_paths, data_transforms), batch_size=BATCH_SIZE, num_workers=8, pin_memory=True)
+
+    with torch.no_grad():
+        for batch_idx, (images, paths) in enumerate(dataloader):
+            dino_output = trunk.forward_features(images.to(DEVICE))
+            store.add(paths, dino_output['x_norm_patchtokens'])
+
+            if ((batch_idx + 1) % FLUSH_STEP) == 0:
+                store.flush()
+                print(f'{min((batch_idx + 1) * BATCH_SIZE, len(image_paths))}/{len(image_paths)}')
+
+    store.flush()
+    print('Finished Extraction !')
@@ -0,0 +1,34 @@
+from abc import ABC, abstractmethod
+import torch
+
+class GoalTableMixin(ABC):
+    # Goal table and collate_fn shared by the SPOT datasets, which implement load_goal_table()
+    # and call init_goal_batching() in their constructor
+    def init_goal_batching(self, return_goal_index, unique_goals):
+        # Return the goal index in place of the goal image, batches then need collate_fn
+        self.return_goal_index = return_goal_index
+        # collate_fn then returns the unique goals of the batch and a goal_inverse_index per sample
+        self.unique_goals = unique_goals
+        # Goals, built on first use
+        self._goal_table = None
+
+    @abstractmethod
+    def load_goal_table(self):
+        # (num_goals, ...) goals of the dataset, indexed by goal index
+        pass
+
+    def goal_table(self):
+        # Every goal is transformed once, so the transform must be deterministic. Call it before the
+        # DataLoader starts its workers, which then share the table rather than each building its own
+        if self._goal_table is None:
+            self._goal_table = self.load_goal_table().share_memory_()
+        return self._goal_table
+
+    def collate_fn(self, batch):
+        # Batches of return_goal_index samples, gathers the goal of every sample from the goal table
+        steps, goal_indices, labels = zip(*batch)
+        goal_indices = torch.tensor(goal_indices, dtype=torch.long)
+        if self.unique_goals:
+            goal_indices, goal_inverse_index = torch.unique(goal_indices, return_inverse=True)
+            return torch.stack(steps, dim=0), self.goal_table()[goal_indices], torch.stack(labels, dim=0), goal_inverse_index
+        return torch.stack(steps, dim=0), self.goal_table()[goal_indices], torch.stack(labels, dim=0)
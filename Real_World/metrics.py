@@ -0,0 +1,51 @@
+import torch
+
+class ToleranceAccuracy:
+    # Accuracy within tolerance (L1 over the axes) and mean absolute error per axis, accumulated on the device
+    def __init__(self, tolerance, num_axes=3, device='cpu'):
+        self.tolerance = tolerance
+        self.num_axes = num_axes
+        self.device = device
+        self.reset()
+
+    def reset(self):
+        # float64 totals, exact for counts and for error sums over a whole epoch
+        self.num_correct = torch.zeros((), dtype=torch.float64, device=self.device)
+        self.abs_error_sum = torch.zeros(self.num_axes, dtype=torch.float64, device=self.device)
+        self.num_total = 0
+
+    def update(self, output, labels):
+        abs_error = (output.detach() - labels).abs()
+        self.num_correct += (abs_error.sum(dim=1) < self.tolerance).sum()
+        self.abs_error_sum += abs_error.sum(dim=0)
+        self.num_total += output.shape[0]
+
+    def compute(self):
+        totals = torch.cat([self.num_correct.view(1), self.abs_error_sum]).tolist()
+        num_total = max(self.num_total, 1)
+        return {'accuracy': totals[0] / num_total * 100,
+                'mae': [abs_error_sum / num_total for abs_error_sum in totals[1:]]}
+
+class DiscretizedAccuracy:
+    # Exact-match and per-axis accuracy of (B, num_axes, num_classes) logits, accumulated on the device
+    def __init__(self, num_axes=3, device='cpu'):
+        self.num_axes = num_axes
+        self.device = device
+        self.reset()
+
+    def reset(self):
+        self.num_correct = torch.zeros((), dtype=torch.long, device=self.device)
+        self.num_axis_correct = torch.zeros(self.num_axes, dtype=torch.long, device=self.device)
+        self.num_total = 0
+
+    def update(self, outputs, labels):
+        correct = torch.argmax(outputs.detach(), dim=2) == labels
+        self.num_correct += torch.all(correct, dim=1).sum()
+        self.num_axis_correct += correct.sum(dim=0)
+        self.num_total += outputs.shape[0]
+
+    def compute(self):
+        totals = torch.cat([self.num_correct.view(1), self.num_axis_correct]).tolist()
+        num_total = max(self.num_total, 1)
+        return {'accuracy': totals[0] / num_total * 100,
+                'axis_accuracy': [num_correct / num_total * 100 for num_correct in totals[1:]]}
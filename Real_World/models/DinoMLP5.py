@@ -1,54 +1,30 @@
 import torch
 import torch.nn as nn
-
-class CrossAttentionBlock(nn.Module):
-    def __init__(self, embed_dim, num_heads=8):
-        super(CrossAttentionBlock, self).__init__()
-        self.mha = nn.MultiheadAttention(embed_dim, num_heads)
-
-    def forward(self, query, key_value):
-        # query and key_value: (B, C, H, W)
-        B, C, H, W = query.shape
-
-        # (H*W, B, C)
-        query_flat = query.view(B, C, -1).permute(2, 0, 1)
-        key_value_flat = key_value.view(B, C, -1).permute(2, 0, 1)
-        attn_output, _ = self.mha(query_flat, key_value_flat, key_value_flat)
-
-        # (B, C, H, W)
-        attn_output = attn_output.permute(1, 2, 0).view(B, C, H, W)
-        return attn_output
+from models.grouped_heads import GroupedConvHeads
+from models.cross_attention import BidirectionalCrossAttention
+from models.dino_trunk import load_dino_trunk, exclude_trunk_state
+from models.trunk_batching import fold_views, unfold_views, run_chunked, unique_goals
 
 class SharedDinoMLP5(nn.Module):
-    def __init__(self):
+    def __init__(self, load_trunk=True, trunk_chunk_size=None):
         super(SharedDinoMLP5, self).__init__()
-        # Shared DinoV2 trunk (excluding the last 2 layers)
-        self.shared_trunk = torch.hub.load('facebookresearch/dinov2', 'dinov2_vits14_reg')
-        for param in self.shared_trunk.parameters():
-            param.requires_grad = False
-        self.shared_trunk.eval()
-        self.global_pool = nn.AdaptiveAvgPool2d((1, 1))
+        # Shared DinoV2 trunk, None when training on precomputed patch tokens. Frozen, so it is left
+        # out of the state_dict and checkpoints load with and without it
+        self.add_module('shared_trunk', load_dino_trunk() if load_trunk else None)
+        exclude_trunk_state(self)
+        # Max images per trunk call, None passes all cameras and the goal at once
+        self.trunk_chunk_size = trunk_chunk_size
         num_trunk_channels = 384
         self.num_cameras = 5
 
-        # Camera-specific heads for current images
-        self.current_heads = nn.ModuleList([
-            nn.Sequential(
-                nn.Conv2d(num_trunk_channels, num_trunk_channels, kernel_size=1),
-                nn.ReLU(inplace=True)
-            ) for _ in range(self.num_cameras)
-        ])
+        # Camera-specific heads for current images, one grouped conv over all cameras
+        self.current_heads = GroupedConvHeads(self.num_cameras, [num_trunk_channels, num_trunk_channels], kernel_size=1)
 
-        # Camera-specific heads for the goal image
-        self.goal_heads = nn.ModuleList([
-            nn.Sequential(
-                nn.Conv2d(num_trunk_channels, num_trunk_channels, kernel_size=1),
-                nn.ReLU(inplace=True)
-            ) for _ in range(self.num_cameras)
-        ])
+        # Camera-specific heads for the goal image, one grouped conv over all cameras
+        self.goal_heads = GroupedConvHeads(self.num_cameras, [num_trunk_channels, num_trunk_channels], kernel_size=1)
 
-        # Cross-attention block shared across cameras
-        self.cross_attention = CrossAttentionBlock(embed_dim=num_trunk_channels, num_heads=8)
+        # Cross-attention block shared across cameras, run for all cameras and both directions at once
+        self.cross_attention = BidirectionalCrossAttention(embed_dim=num_trunk_channels, num_heads=8)
 
         # Fully connected layers.
         # Input feature dimension: 5 cameras * 2 (current + goal) * 512 = 5120.
@@ -71,44 +47,46 @@ class SharedDinoMLP5(nn.Module):
         # Final output layer produces 3 regression outputs.
         self.fc_layer5 = nn.Linear(1024, 3)
 
-    def forward(self, current_images, goal_image):
-        batch_size = current_images.size(0)
-        current_features_list = []
-        goal_features_list = []
+    def forward(self, current_images, goal_image, goal_inverse_index=None, goal_ids=None):
+        # goal_inverse_index: (B,) goal_image row of every sample, None for one goal image per sample
+        # goal_ids: (B,) goal of every sample when goal_image holds one per sample, each distinct goal is encoded once
+        if goal_ids is not None:
+            goal_image, goal_inverse_index = unique_goals(goal_image, goal_ids)
+        # Without a trunk the inputs are already patch tokens
+        if self.shared_trunk is None:
+            return self.forward_tokens(current_images, goal_image, goal_inverse_index)
 
-        # Processing the goal image once through the shared trunk.
+        # Goal and cameras folded into the batch dimension for a single trunk pass.
         with torch.no_grad():
-            dino_output = self.shared_trunk.forward_features(goal_image)
-        goal_trunk_feat = torch.reshape(dino_output['x_norm_patchtokens'], [-1, 16, 16, 384])
-        goal_trunk_feat = goal_trunk_feat.permute(0, 3, 1, 2)
-
-        for cam_idx in range(self.num_cameras):
-            # Processing current image for camera cam_idx.
-            curr = current_images[:, cam_idx, :, :, :]  # (B, C, H, W)
-            with torch.no_grad():
-                dino_output = self.shared_trunk.forward_features(curr)
-            curr_feat = torch.reshape(dino_output['x_norm_patchtokens'], [-1, 16, 16, 384])
-            curr_feat = curr_feat.permute(0, 3, 1, 2)
-            curr_feat = self.current_heads[cam_idx](curr_feat)
-
-            # Processing the same goal image
-            goal_feat = self.goal_heads[cam_idx](goal_trunk_feat)
-
-            # Applying cross-attention in both directions.
-            curr_attended = curr_feat + self.cross_attention(curr_feat, goal_feat)
-            goal_attended = goal_feat + self.cross_attention(goal_feat, curr_feat)
-
-            # Global pooling.
-            curr_pooled = self.global_pool(curr_attended).view(batch_size, -1)  # (B, 512)
-            goal_pooled = self.global_pool(goal_attended).view(batch_size, -1)  # (B, 512)
-
-            current_features_list.append(curr_pooled)
-            goal_features_list.append(goal_pooled)
-
-        # Concatenating features from all cameras.
-        current_features = torch.cat(current_features_list, dim=1)  # (B, 5*512)
-        goal_features = torch.cat(goal_features_list, dim=1)        # (B, 5*512)
-        features = torch.cat([current_features, goal_features], dim=1)  # (B, 5120)
+            images = fold_views(current_images[:, :self.num_cameras], goal_image)  # (G+B*5, C, H, W)
+            tokens = run_chunked(lambda x: self.shared_trunk.forward_features(x)['x_norm_patchtokens'],
+                                 images, self.trunk_chunk_size)
+            current_tokens, goal_tokens = unfold_views(tokens, current_images.size(0), goal_image.size(0))
+
+        return self.forward_tokens(current_tokens, goal_tokens, goal_inverse_index)
+
+    def forward_tokens(self, current_tokens, goal_tokens, goal_inverse_index=None):
+        # current_tokens: (B, 5, 256, 384), goal_tokens: (G, 256, 384), G is B without goal_inverse_index
+        batch_size = current_tokens.size(0)
+
+        # Camera-major tokens, kept token-major through heads, attention and pooling
+        current_feats = self.current_heads(current_tokens.transpose(0, 1))  # (5, B, 256, 384)
+        goal_feats = self.goal_heads(goal_tokens)                           # (5, G, 256, 384)
+
+        # Goal features of every sample
+        if goal_inverse_index is not None:
+            assert goal_inverse_index.max() < goal_feats.size(1), 'goal_inverse_index points past the goals, was goal_image split from it?'
+            goal_feats = goal_feats[:, goal_inverse_index]                  # (5, B, 256, 384)
+
+        # Applying cross-attention in both directions.
+        curr_cross, goal_cross = self.cross_attention(current_feats, goal_feats)
+        curr_attended = current_feats + curr_cross
+        goal_attended = goal_feats + goal_cross
+
+        # Mean pooling over tokens, concatenating features from all cameras.
+        current_features = curr_attended.mean(dim=2).transpose(0, 1).reshape(batch_size, -1)  # (B, cameras*384)
+        goal_features = goal_attended.mean(dim=2).transpose(0, 1).reshape(batch_size, -1)     # (B, cameras*384)
+        features = torch.cat([current_features, goal_features], dim=1)
 
         # Fully connected layers.
         x = self.fc_layer1(features)
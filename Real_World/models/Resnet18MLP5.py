@@ -1,53 +1,29 @@
 import torch
 import torch.nn as nn
+from models.grouped_heads import GroupedConvHeads
+from models.cross_attention import BidirectionalCrossAttention
+from models.trunk_batching import fold_views, unfold_views, run_chunked
 from torchvision.models import resnet18, ResNet18_Weights
 
-class CrossAttentionBlock(nn.Module):
-    def __init__(self, embed_dim, num_heads=8):
-        super(CrossAttentionBlock, self).__init__()
-        self.mha = nn.MultiheadAttention(embed_dim, num_heads)
-
-    def forward(self, query, key_value):
-        # query and key_value: (B, C, H, W)
-        B, C, H, W = query.shape
-
-        # (H*W, B, C)
-        query_flat = query.view(B, C, -1).permute(2, 0, 1)
-        key_value_flat = key_value.view(B, C, -1).permute(2, 0, 1)
-        attn_output, _ = self.mha(query_flat, key_value_flat, key_value_flat)
-
-        # (B, C, H, W)
-        attn_output = attn_output.permute(1, 2, 0).view(B, C, H, W)
-        return attn_output
-
 class SharedResNet18MLP5(nn.Module):
-    def __init__(self):
+    def __init__(self, trunk_chunk_size=None):
         super(SharedResNet18MLP5, self).__init__()
         # Shared ResNet18 trunk (excluding the last 2 layers)
         base_resnet = resnet18(weights=ResNet18_Weights.DEFAULT)
         self.shared_trunk = nn.Sequential(*list(base_resnet.children())[:-2])
-        self.global_pool = nn.AdaptiveAvgPool2d((1, 1))
+        # Max images per trunk call at inference, None passes all cameras and the goal at once
+        self.trunk_chunk_size = trunk_chunk_size
         num_trunk_channels = 512
         self.num_cameras = 5
 
-        # Camera-specific heads for current images
-        self.current_heads = nn.ModuleList([
-            nn.Sequential(
-                nn.Conv2d(num_trunk_channels, num_trunk_channels, kernel_size=1),
-                nn.ReLU(inplace=True)
-            ) for _ in range(self.num_cameras)
-        ])
+        # Camera-specific heads for current images, one grouped conv over all cameras
+        self.current_heads = GroupedConvHeads(self.num_cameras, [num_trunk_channels, num_trunk_channels], kernel_size=1)
 
-        # Camera-specific heads for the goal image
-        self.goal_heads = nn.ModuleList([
-            nn.Sequential(
-                nn.Conv2d(num_trunk_channels, num_trunk_channels, kernel_size=1),
-                nn.ReLU(inplace=True)
-            ) for _ in range(self.num_cameras)
-        ])
+        # Camera-specific heads for the goal image, one grouped conv over all cameras
+        self.goal_heads = GroupedConvHeads(self.num_cameras, [num_trunk_channels, num_trunk_channels], kernel_size=1)
 
-        # Cross-attention block shared across cameras
-        self.cross_attention = CrossAttentionBlock(embed_dim=num_trunk_channels, num_heads=8)
+        # Cross-attention block shared across cameras, run for all cameras and both directions at once
+        self.cross_attention = BidirectionalCrossAttention(embed_dim=num_trunk_channels, num_heads=8)
 
         # Fully connected layers.
         # Input feature dimension: 5 cameras * 2 (current + goal) * 512 = 5120.
@@ -72,36 +48,28 @@ class SharedResNet18MLP5(nn.Module):
 
     def forward(self, current_images, goal_image):
         batch_size = current_images.size(0)
-        current_features_list = []
-        goal_features_list = []
-
-        # Processing the goal image once through the shared trunk.
-        goal_trunk_feat = self.shared_trunk(goal_image)  # (B, 512, H', W')
-
-        for cam_idx in range(self.num_cameras):
-            # Processing current image for camera cam_idx.
-            curr = current_images[:, cam_idx, :, :, :]  # (B, C, H, W)
-            curr_feat = self.shared_trunk(curr)         # (B, 512, H', W')
-            curr_feat = self.current_heads[cam_idx](curr_feat)
-
-            # Processing the same goal image
-            goal_feat = self.goal_heads[cam_idx](goal_trunk_feat)
-
-            # Applying cross-attention in both directions.
-            curr_attended = curr_feat + self.cross_attention(curr_feat, goal_feat)
-            goal_attended = goal_feat + self.cross_attention(goal_feat, curr_feat)
-
-            # Global pooling.
-            curr_pooled = self.global_pool(curr_attended).view(batch_size, -1)  # (B, 512)
-            goal_pooled = self.global_pool(goal_attended).view(batch_size, -1)  # (B, 512)
-
-            current_features_list.append(curr_pooled)
-            goal_features_list.append(goal_pooled)
 
-        # Concatenating features from all cameras.
-        current_features = torch.cat(current_features_list, dim=1)  # (B, 5*512)
-        goal_features = torch.cat(goal_features_list, dim=1)        # (B, 5*512)
-        features = torch.cat([current_features, goal_features], dim=1)  # (B, 5120)
+        # Goal and cameras folded into the batch dimension for the trunk pass.
+        # While training, BatchNorm statistics stay per view, so each view is its own call.
+        images = fold_views(current_images[:, :self.num_cameras], goal_image)  # (B*(cameras+1), C, H, W)
+        chunk_size = batch_size if self.training else self.trunk_chunk_size
+        trunk_feat = run_chunked(self.shared_trunk, images, chunk_size)
+        trunk_tokens = trunk_feat.flatten(2).transpose(1, 2)                  # (B*(cameras+1), H'*W', 512)
+        current_tokens, goal_tokens = unfold_views(trunk_tokens, batch_size)  # (B, cameras, H'*W', 512), (B, H'*W', 512)
+
+        # Camera-major tokens, kept token-major through heads, attention and pooling.
+        current_feats = self.current_heads(current_tokens.transpose(0, 1))  # (cameras, B, H'*W', 512)
+        goal_feats = self.goal_heads(goal_tokens)                           # (cameras, B, H'*W', 512)
+
+        # Applying cross-attention in both directions.
+        curr_cross, goal_cross = self.cross_attention(current_feats, goal_feats)
+        curr_attended = current_feats + curr_cross
+        goal_attended = goal_feats + goal_cross
+
+        # Mean pooling over tokens, concatenating features from all cameras.
+        current_features = curr_attended.mean(dim=2).transpose(0, 1).reshape(batch_size, -1)  # (B, cameras*512)
+        goal_features = goal_attended.mean(dim=2).transpose(0, 1).reshape(batch_size, -1)     # (B, cameras*512)
+        features = torch.cat([current_features, goal_features], dim=1)
 
         # Fully connected layers.
         x = self.fc_layer1(features)
@@ -0,0 +1,75 @@
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+class FusedQKVAttention(nn.Module):
+    # Multi-head attention on scaled_dot_product_attention, with the parameters of nn.MultiheadAttention
+    def __init__(self, embed_dim, num_heads):
+        super(FusedQKVAttention, self).__init__()
+        self.embed_dim = embed_dim
+        self.num_heads = num_heads
+        self.in_proj_weight = nn.Parameter(torch.empty(3 * embed_dim, embed_dim))
+        self.in_proj_bias = nn.Parameter(torch.zeros(3 * embed_dim))
+        self.out_proj = nn.Linear(embed_dim, embed_dim)
+
+        # Same initialisation as nn.MultiheadAttention
+        nn.init.xavier_uniform_(self.in_proj_weight)
+        nn.init.zeros_(self.out_proj.bias)
+
+    def project(self, x):
+        # (B, N, C) -> q, k, v, each (B, num_heads, N, head_dim)
+        B, N, C = x.shape
+        qkv = F.linear(x, self.in_proj_weight, self.in_proj_bias)
+        qkv = qkv.view(B, N, 3, self.num_heads, C // self.num_heads).permute(2, 0, 3, 1, 4)
+        return qkv.unbind(0)
+
+    def attend(self, q, k, v):
+        # (B, num_heads, N, head_dim) -> (B, N, C)
+        attn_output = F.scaled_dot_product_attention(q, k, v)
+        B, _, N, _ = attn_output.shape
+        attn_output = attn_output.transpose(1, 2).reshape(B, N, self.embed_dim)
+        return self.out_proj(attn_output)
+
+    def forward(self, query, key_value):
+        # query: (B, N, C), key_value: (B, S, C)
+        B, N, C = query.shape
+        q = F.linear(query, self.in_proj_weight[:C], self.in_proj_bias[:C])
+        kv = F.linear(key_value, self.in_proj_weight[C:], self.in_proj_bias[C:])
+
+        q = q.view(B, N, self.num_heads, -1).transpose(1, 2)
+        k, v = kv.view(B, key_value.size(1), 2, self.num_heads, -1).permute(2, 0, 3, 1, 4).unbind(0)
+        return self.attend(q, k, v)
+
+class CrossAttentionBlock(nn.Module):
+    def __init__(self, embed_dim, num_heads=8):
+        super(CrossAttentionBlock, self).__init__()
+        self.mha = FusedQKVAttention(embed_dim, num_heads)
+
+    def forward(self, query, key_value):
+        # query and key_value: batch_first tokens (B, N, C)
+        return self.mha(query, key_value)
+
+class BidirectionalCrossAttention(nn.Module):
+    # Current->goal and goal->current cross-attention of every camera in one attention call
+    # Same 'mha' parameters as CrossAttentionBlock
+    def __init__(self, embed_dim, num_heads=8):
+        super(BidirectionalCrossAttention, self).__init__()
+        self.mha = FusedQKVAttention(embed_dim, num_heads)
+
+    def forward(self, current_tokens, goal_tokens):
+        # current_tokens: camera-major (V, B, N, C), goal_tokens: (V, B, N, C) or (B, N, C) shared by every camera
+        # Returns the attention outputs for the current and goal tokens, (V, B, N, C) each
+        V, B, N, C = current_tokens.shape
+
+        # (V, B, num_heads, N, head_dim), a shared goal is projected once and repeated per camera
+        q_curr, k_curr, v_curr = [t.unflatten(0, (V, B)) for t in self.mha.project(current_tokens.reshape(V * B, N, C))]
+        q_goal, k_goal, v_goal = [t.unflatten(0, (-1, B)).expand(V, -1, -1, -1, -1)
+                                  for t in self.mha.project(goal_tokens.reshape(-1, N, C))]
+
+        # Current queries attend to goal keys, then goal queries to current keys
+        q = torch.cat([q_curr, q_goal], dim=0).flatten(0, 1)
+        k = torch.cat([k_goal, k_curr], dim=0).flatten(0, 1)
+        v = torch.cat([v_goal, v_curr], dim=0).flatten(0, 1)
+
+        attn_output = self.mha.attend(q, k, v).view(2, V, B, N, C)
+        return attn_output[0], attn_output[1]
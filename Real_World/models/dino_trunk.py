@@ -0,0 +1,46 @@
+import hashlib
+import torch
+
+DINO_REPO = 'facebookresearch/dinov2'
+DINO_MODEL = 'dinov2_vits14_reg'
+
+# x_norm_patchtokens of a 224x224 image: 16x16 patches of 384 channels
+DINO_PATCH_GRID = 16
+DINO_NUM_PATCHES = DINO_PATCH_GRID * DINO_PATCH_GRID
+DINO_EMBED_DIM = 384
+
+def load_dino_trunk():
+    # Frozen DinoV2 trunk shared by all Dino models
+    trunk = torch.hub.load(DINO_REPO, DINO_MODEL)
+    for param in trunk.parameters():
+        param.requires_grad = False
+    trunk.eval()
+    return trunk
+
+def trunk_weights_hash(trunk):
+    # Short hash of the trunk weights, used to key precomputed patch tokens
+    sha = hashlib.sha1()
+    for name, tensor in sorted(trunk.state_dict().items()):
+        sha.update(name.encode())
+        sha.update(tensor.detach().cpu().contiguous().numpy().tobytes())
+    return sha.hexdigest()[:16]
+
+def exclude_trunk_state(module, attribute='shared_trunk'):
+    # Keeps the frozen trunk, always rebuilt from the hub, out of module's state_dict, so checkpoints
+    # saved with and without the trunk load into either
+    trunk_prefix = attribute + '.'
+
+    def save_hook(module, state_dict, prefix, local_metadata):
+        for key in [key for key in state_dict if key.startswith(prefix + trunk_prefix)]:
+            del state_dict[key]
+
+    def load_pre_hook(state_dict, prefix, *args):
+        for key in [key for key in state_dict if key.startswith(prefix + trunk_prefix)]:
+            del state_dict[key]
+        # A loaded trunk keeps its own weights
+        trunk = getattr(module, attribute)
+        if trunk is not None:
+            state_dict.update({prefix + trunk_prefix + key: value for key, value in trunk.state_dict().items()})
+
+    module._register_state_dict_hook(save_hook)
+    module._register_load_state_dict_pre_hook(load_pre_hook)
@@ -0,0 +1,133 @@
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+class GroupedConvHeads(nn.Module):
+    # Camera-specific Conv2d heads as one grouped convolution per layer, with the state_dict keys
+    # of the per-camera nn.ModuleList ('<camera>.<layer>.weight')
+    def __init__(self, num_heads, channels, kernel_size=1, padding=0):
+        # channels: [in, hidden, ..., out], one Conv2d per consecutive pair and a ReLU after the last
+        super(GroupedConvHeads, self).__init__()
+        self.num_heads = num_heads
+        self.channels = list(channels)
+        self.kernel_size = kernel_size
+        self.padding = padding
+        self.num_layers = len(channels) - 1
+
+        for layer, (in_channels, out_channels) in enumerate(zip(channels[:-1], channels[1:])):
+            # Grouped Conv2d init has the same fan-in as the per-camera Conv2d
+            conv = nn.Conv2d(num_heads * in_channels, num_heads * out_channels,
+                             kernel_size=kernel_size, padding=padding, groups=num_heads)
+            self.register_parameter(f'weight_{layer}', conv.weight)
+            self.register_parameter(f'bias_{layer}', conv.bias)
+
+    def layer_params(self, layer):
+        return getattr(self, f'weight_{layer}'), getattr(self, f'bias_{layer}')
+
+    def forward(self, x, grid_size=None):
+        # x: camera-major tokens (num_heads, B, N, C_in), or (B, N, C_in) shared by every head
+        # Returns (num_heads, B, N, C_out). Kernels above 1x1 need the (H, W) grid_size of the tokens
+        if self.kernel_size == 1:
+            return self._forward_linear(x)
+        return self._forward_spatial(x, grid_size)
+
+    def _forward_linear(self, x):
+        # 1x1 convolutions are per-camera Linear layers on the tokens, one batched matmul per layer
+        B, N, C = x.shape[-3:]
+        x = x.reshape(-1, B * N, C).expand(self.num_heads, -1, -1)
+        for layer in range(self.num_layers):
+            weight, bias = self.layer_params(layer)
+            weight = weight.view(self.num_heads, -1, weight.size(1))  # (num_heads, C_out, C_in)
+            x = torch.baddbmm(bias.view(self.num_heads, 1, -1), x, weight.transpose(1, 2))
+        x = F.relu(x, inplace=True)
+
+        return x.view(self.num_heads, B, N, -1)
+
+    def _forward_spatial(self, x, grid_size):
+        # Grouped convolution over (B, num_heads * C, H, W), only reshaped for kernels that need it
+        B, N, C = x.shape[-3:]
+        if x.dim() == 3:
+            # Stacked weights of the first layer are a plain Conv2d over a shared input
+            x = x.transpose(1, 2).reshape(B, C, *grid_size)
+            weight, bias = self.layer_params(0)
+            x = F.conv2d(x, weight, bias, padding=self.padding)
+            first_layer = 1
+        else:
+            x = x.permute(1, 0, 3, 2).reshape(B, self.num_heads * C, *grid_size)
+            first_layer = 0
+
+        for layer in range(first_layer, self.num_layers):
+            weight, bias = self.layer_params(layer)
+            x = F.conv2d(x, weight, bias, padding=self.padding, groups=self.num_heads)
+        x = F.relu(x, inplace=True)
+
+        return x.view(B, self.num_heads, -1, N).permute(1, 0, 3, 2)
+
+    def _per_head_params(self):
+        # Yields (per-camera key, slice of the fused parameter) in ModuleList order
+        for head in range(self.num_heads):
+            for layer in range(self.num_layers):
+                for name, param in zip(('weight', 'bias'), self.layer_params(layer)):
+                    yield f'{head}.{layer}.{name}', param.chunk(self.num_heads, dim=0)[head]
+
+    def _save_to_state_dict(self, destination, prefix, keep_vars):
+        for key, param in self._per_head_params():
+            # Clone, a view would serialise the whole fused tensor
+            destination[prefix + key] = param if keep_vars else param.detach().clone()
+
+    def _load_from_state_dict(self, state_dict, prefix, local_metadata, strict, missing_keys, unexpected_keys, error_msgs):
+        expected_keys = set()
+        with torch.no_grad():
+            for key, param in self._per_head_params():
+                key = prefix + key
+                expected_keys.add(key)
+                if key not in state_dict:
+                    missing_keys.append(key)
+                    continue
+
+                value = state_dict[key]
+                if value.shape != param.shape:
+                    error_msgs.append(f'size mismatch for {key}: copying a param with shape {tuple(value.shape)} from checkpoint, '
+                                      f'the shape in current model is {tuple(param.shape)}.')
+                    continue
+                param.copy_(value)
+
+        if strict:
+            for key in state_dict:
+                if key.startswith(prefix) and key not in expected_keys:
+                    unexpected_keys.append(key)
+
+    @classmethod
+    def from_module_list(cls, heads, kernel_size=1, padding=0):
+        # heads: nn.ModuleList of per-camera nn.Sequential(Conv2d, ..., ReLU)
+        convs = [module for module in heads[0] if isinstance(module, nn.Conv2d)]
+        channels = [convs[0].in_channels] + [conv.out_channels for conv in convs]
+        fused = cls(len(heads), channels, kernel_size=kernel_size, padding=padding)
+        fused.load_state_dict(heads.state_dict())
+        return fused.to(convs[0].weight.device)
+
+    def to_module_list(self):
+        heads = nn.ModuleList([
+            nn.Sequential(
+                *[nn.Conv2d(in_channels, out_channels, kernel_size=self.kernel_size, padding=self.padding)
+                  for in_channels, out_channels in zip(self.channels[:-1], self.channels[1:])],
+                nn.ReLU(inplace=True)
+            ) for _ in range(self.num_heads)
+        ])
+        heads.load_state_dict(self.state_dict())
+        return heads.to(self.weight_0.device)
+
+def sequential_on_tokens(heads, tokens, grid_size):
+    # nn.Sequential of Conv2d / ReLU applied to (B, N, C) tokens, returns (B, N, C_out)
+    if all(module.kernel_size == (1, 1) for module in heads if isinstance(module, nn.Conv2d)):
+        for module in heads:
+            if isinstance(module, nn.Conv2d):
+                tokens = F.linear(tokens, module.weight.flatten(1), module.bias)
+            else:
+                tokens = module(tokens)
+        return tokens
+
+    # Larger kernels run on the spatial map
+    B, N, C = tokens.shape
+    feat = heads(tokens.transpose(1, 2).reshape(B, C, *grid_size))
+    return feat.flatten(2).transpose(1, 2)
@@ -0,0 +1,28 @@
+import torch
+
+def fold_views(current_images, goal_image):
+    # (B, V, 3, H, W) and (G, 3, H, W) -> (G + V * B, 3, H, W)
+    # View-major with the goals first, so every chunk of B images after the goals is exactly one view.
+    # G is B, or fewer when only the unique goals of the batch are passed
+    current_images = current_images.transpose(0, 1).reshape(-1, *current_images.shape[2:])
+    return torch.cat([goal_image, current_images], dim=0)
+
+def unfold_views(features, batch_size, num_goals=None):
+    # (G + V * B, ...) -> current (B, V, ...), goal (G, ...)
+    num_goals = batch_size if num_goals is None else num_goals
+    current_features = features[num_goals:].reshape(-1, batch_size, *features.shape[1:]).transpose(0, 1)
+    return current_features, features[:num_goals]
+
+def run_chunked(trunk_fn, images, chunk_size=None):
+    # Caps peak memory of a folded trunk pass, None runs everything in one call.
+    # chunk_size can also be a list of chunk sizes, as for torch.split
+    if chunk_size is None or (isinstance(chunk_size, int) and chunk_size >= images.size(0)):
+        return trunk_fn(images)
+    return torch.cat([trunk_fn(chunk) for chunk in torch.split(images, chunk_size)], dim=0)
+
+def unique_goals(goal_image, goal_ids):
+    # One goal per sample with its (B,) goal id -> the (G, ...) unique goals and the (B,) goal_inverse_index.
+    # Runs on every DataParallel replica, whose scatter splits samples and cannot split a unique goal table
+    unique_ids, goal_inverse_index = torch.unique(goal_ids, return_inverse=True)
+    sample_of_goal = torch.zeros_like(unique_ids).scatter_(0, goal_inverse_index, torch.arange(goal_ids.size(0), device=goal_ids.device))
+    return goal_image[sample_of_goal], goal_inverse_index
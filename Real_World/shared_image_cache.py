@@ -0,0 +1,135 @@
+import os
+import weakref
+import multiprocessing
+from multiprocessing import shared_memory
+import numpy as np
+import torch
+
+def _release(shm, owner_pid):
+    # Only the process that created the segment removes it, forked workers just drop their mapping
+    try:
+        shm.close()
+    except BufferError:
+        # Arrays still view the segment, the mapping goes with the process
+        pass
+    if os.getpid() == owner_pid:
+        shm.unlink()
+
+class SharedImageCache:
+    # Decoded images in one shared memory slab, addressed by sample index and shared by all DataLoader workers.
+    # Create it before the workers start. When full, a clock policy evicts items not read since the hand passed
+    def __init__(self, num_samples, item_shape, budget_bytes, dtype=np.uint8):
+        self.num_samples = num_samples
+        self.item_shape = tuple(item_shape)
+        self.dtype = np.dtype(dtype)
+        self.item_bytes = int(np.prod(self.item_shape)) * self.dtype.itemsize
+        self.num_slots = min(budget_bytes // self.item_bytes, num_samples)
+        if self.num_slots < 1:
+            raise ValueError(f'Cache budget of {budget_bytes} bytes is smaller than one item of {self.item_bytes} bytes')
+
+        # Segment layout: slot of every sample, sample of every slot, clock bits, ready flags, readers
+        # copying out of every slot, clock hand, then the items
+        self._layout = [('slot_of_sample', np.int64, (num_samples,)),
+                        ('sample_of_slot', np.int64, (self.num_slots,)),
+                        ('referenced', np.uint8, (self.num_slots,)),
+                        ('ready', np.uint8, (self.num_slots,)),
+                        ('readers', np.int32, (self.num_slots,)),
+                        ('hand', np.int64, (1,))]
+        header_bytes = sum(np.dtype(dtype).itemsize * int(np.prod(shape)) for _, dtype, shape in self._layout)
+        self._data_offset = (header_bytes + 63) // 64 * 64
+        self.shm = shared_memory.SharedMemory(create=True, size=self._data_offset + self.num_slots * self.item_bytes)
+        self._finalizer = weakref.finalize(self, _release, self.shm, os.getpid())
+        self._lock = multiprocessing.Lock()
+
+        self._map_arrays()
+        self.slot_of_sample[:] = -1
+        self.sample_of_slot[:] = -1
+        self.referenced[:] = 0
+        self.ready[:] = 0
+        self.readers[:] = 0
+        self.hand[0] = 0
+
+    def _map_arrays(self):
+        offset = 0
+        for name, dtype, shape in self._layout:
+            array = np.ndarray(shape, dtype=dtype, buffer=self.shm.buf, offset=offset)
+            setattr(self, name, array)
+            offset += array.nbytes
+        self.items = np.ndarray((self.num_slots,) + self.item_shape, dtype=self.dtype, buffer=self.shm.buf,
+                                offset=self._data_offset)
+
+    def __getstate__(self):
+        # Spawned workers attach to the segment by name, the arrays are views of it
+        state = self.__dict__.copy()
+        for name in [name for name, _, _ in self._layout] + ['items', 'shm', '_finalizer']:
+            del state[name]
+        state['shm_name'] = self.shm.name
+        return state
+
+    def __setstate__(self, state):
+        self.shm = shared_memory.SharedMemory(name=state.pop('shm_name'))
+        self.__dict__.update(state)
+        self._finalizer = weakref.finalize(self, _release, self.shm, None)
+        self._map_arrays()
+
+    def __len__(self):
+        return int((self.slot_of_sample >= 0).sum())
+
+    def get(self, idx):
+        # Copy of the cached item of sample idx, None when it is not cached. The lock is only held to
+        # pin the slot, which put() never evicts while it has readers, the copy runs outside it
+        with self._lock:
+            slot = int(self.slot_of_sample[idx])
+            if slot < 0 or not self.ready[slot]:
+                return None
+            self.referenced[slot] = 1
+            self.readers[slot] += 1
+        try:
+            return torch.from_numpy(self.items[slot].copy())
+        finally:
+            with self._lock:
+                self.readers[slot] -= 1
+
+    def put(self, idx, item):
+        if isinstance(item, torch.Tensor):
+            item = item.numpy()
+        if item.shape != self.item_shape or item.dtype != self.dtype:
+            raise ValueError(f'Cache holds {self.dtype} items of shape {self.item_shape}, '
+                             f'got {item.dtype} of shape {item.shape}')
+
+        # Claim a slot under the lock, fill it outside, then publish it as ready
+        with self._lock:
+            if self.slot_of_sample[idx] >= 0:
+                return
+
+            # Clock: clear the bits of recently read items until one that was not. Slots being read or
+            # filled are skipped, after two turns of the hand every slot is in use and the item is not cached
+            hand = int(self.hand[0])
+            for _ in range(2 * self.num_slots):
+                if self.readers[hand] or (self.sample_of_slot[hand] >= 0 and not self.ready[hand]):
+                    pass
+                elif self.referenced[hand]:
+                    self.referenced[hand] = 0
+                else:
+                    break
+                hand = (hand + 1) % self.num_slots
+            else:
+                return
+            self.hand[0] = (hand + 1) % self.num_slots
+
+            evicted = self.sample_of_slot[hand]
+            if evicted >= 0:
+                self.slot_of_sample[evicted] = -1
+            self.ready[hand] = 0
+            self.sample_of_slot[hand] = idx
+            self.slot_of_sample[idx] = hand
+
+        self.items[hand] = item
+        with self._lock:
+            self.ready[hand] = 1
+            self.referenced[hand] = 1
+
+    def close(self):
+        for name in [name for name, _, _ in self._layout] + ['items']:
+            self.__dict__.pop(name, None)
+        self._finalizer()
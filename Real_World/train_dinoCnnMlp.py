@@ -2,11 +2,20 @@ import torch, os
 import numpy as np
 from torchvision import transforms
 from torch.utils.data import DataLoader
+from torch.nn.modules.utils import consume_prefix_in_state_dict_if_present
 from SPOT_SingleStep_DataLoader import SPOT_SingleStep_DataLoader
 from models.DinoCnn2MLP3 import DinoCnn2MLP3
+from dino_feature_store import DinoFeatureStore
+from trajectory_sampler import TrajectoryChunkBatchSampler
+from batch_transforms import uint8_transforms, BatchNormalize
+from shared_image_cache import SharedImageCache
+from metrics import ToleranceAccuracy
+from training_loop import train_one_epoch
 from plot_graph import plot_graph
 
 CONTINUE = 0   # Start fresh at 0
+UINT8_TRANSPORT = True   # Workers return uint8 images, normalised per batch on the device
+IMAGE_CACHE_GB = 0   # Decoded images kept in shared memory across epochs, needs UINT8_TRANSPORT, 0 disables
 
 # Setup Destination
 MODEL_NAME = 'DinoCnnMLP'
@@ -16,14 +25,20 @@ DATASET_DIR = '/data/lee04484/SPOT_Real_World_Dataset/cleanup_dataset'
 # Hyper Parameters
 BATCH_SIZE = 128
 LEARNING_RATE = 1e-4
+TRAJECTORY_CHUNK_SIZE = 8   # Consecutive steps of a trajectory per batch chunk, 1 is a full shuffle
 
 # Training Parameters
 WEIGHT_SAVING_STEP = 20
+LOG_INTERVAL = 0   # Steps between loss prints within an epoch, 0 for none. Each print waits for the device
 LOSS_SCALE = 1e3
 
 # Validation Parameter
 TOLERANCE = 1e-2
 
+# Heads-only training on precomputed DinoV2 patch tokens (run extract_dino_features.py first)
+HEADS_ONLY = False
+FEATURE_STORE_DIR = '/data/lee04484/SPOT_Real_World_Dataset/dino_features/'
+
 def get_top_available_gpus(n=3):
     # Get available memory for each GPU and return the indices of the top n GPUs
     gpu_free_memory = []
@@ -66,13 +81,16 @@ if __name__ == '__main__':
         top_gpus = get_top_available_gpus(2)
         primary_device = f'cuda:{top_gpus[0]}'
         print(f'Using GPUs: {top_gpus}')
-        model = DinoCnn2MLP3().to(primary_device)
-        model = torch.nn.DataParallel(model, device_ids=top_gpus)
+        model = DinoCnn2MLP3(load_trunk=not HEADS_ONLY).to(primary_device)
+        if len(top_gpus) > 1:
+            model = torch.nn.DataParallel(model, device_ids=top_gpus)
         DEVICE = primary_device  # For consistency in moving tensors to device
     else:
         DEVICE = 'cpu'
         print('Using CPU')
-        model = DinoCnn2MLP3().to(DEVICE)
+        model = DinoCnn2MLP3(load_trunk=not HEADS_ONLY).to(DEVICE)
+
+    base_model = model.module if isinstance(model, torch.nn.DataParallel) else model
 
     # Saving Hyper Param
     hyper_params_path = os.path.join(WEIGHT_PATH, 'hyper_params')
@@ -93,7 +111,10 @@ if __name__ == '__main__':
 
     if CONTINUE > 1:
         lastest_weight_path = os.path.join(WEIGHT_PATH, 'epoch_' + str(CONTINUE) + '.pth')
-        model.load_state_dict(torch.load(lastest_weight_path))
+        # Checkpoints hold the unwrapped model, older ones were saved through DataParallel
+        state_dict = torch.load(lastest_weight_path)
+        consume_prefix_in_state_dict_if_present(state_dict, 'module.')
+        base_model.load_state_dict(state_dict)
         print('Weight Loaded!')
         training_losses = list(np.load(tracking_losses_path))[:CONTINUE]
         tracking_losses_path = os.path.join(FIGURE_PATH, 'new_training_losses.npy')
@@ -103,33 +124,48 @@ if __name__ == '__main__':
 
     train_dataset = SPOT_SingleStep_DataLoader(
             dataset_dirs=DATASET_PATHS,
-            transform=data_transforms
+            transform=uint8_transforms if UINT8_TRANSPORT else data_transforms,
+            feature_store=DinoFeatureStore(FEATURE_STORE_DIR, data_transforms) if HEADS_ONLY else None,
+            return_goal_index=True,
+            unique_goals=True
         )
-    train_dataloader = DataLoader(train_dataset, batch_size=BATCH_SIZE, shuffle=True, num_workers=8, pin_memory=True)
+    if IMAGE_CACHE_GB > 0 and not HEADS_ONLY:
+        if not UINT8_TRANSPORT:
+            raise ValueError('IMAGE_CACHE_GB needs UINT8_TRANSPORT, the cache holds uint8 images')
+        train_dataset.image_cache = SharedImageCache(len(train_dataset), (5, 3, 224, 224), int(IMAGE_CACHE_GB * 2**30))
+    batch_normalize = BatchNormalize().to(DEVICE)
+    train_sampler = TrajectoryChunkBatchSampler(train_dataset.goal_indices, BATCH_SIZE, chunk_size=TRAJECTORY_CHUNK_SIZE)
+    # Goal table built once before the workers start, they share it instead of each decoding every goal every epoch
+    train_dataset.goal_table()
+    train_dataloader = DataLoader(train_dataset, batch_sampler=train_sampler, num_workers=8, pin_memory=True,
+                                  collate_fn=train_dataset.collate_fn)
+
+    # Accumulated on the device, read back once per epoch
+    train_metrics = ToleranceAccuracy(TOLERANCE, device=DEVICE)
+
+    def step_loss(batch):
+        # Loss of one training batch, on the device
+        current_images, goal_image, labels, goal_inverse_index = batch
+
+        current_images = batch_normalize(current_images.to(DEVICE))
+        goal_image = batch_normalize(goal_image.to(DEVICE))
+        labels = labels.to(DEVICE)
+        goal_inverse_index = goal_inverse_index.to(DEVICE)
+        # DataParallel scatters samples, so it gets one goal per sample and its goal id, every replica
+        # then encodes the distinct goals of its samples once
+        goal_ids = None
+        if isinstance(model, torch.nn.DataParallel):
+            goal_image, goal_ids, goal_inverse_index = goal_image[goal_inverse_index], goal_inverse_index, None
+
+        output = model(current_images, goal_image, goal_inverse_index, goal_ids)
+        loss = loss_fn(output, labels) * LOSS_SCALE
+        return loss
 
     # Train Model
     for epoch in range(CONTINUE, 1000):
+        train_sampler.set_epoch(epoch)
 
-        model.train()
-        running_loss = 0.0
-
-        for current_images, goal_image, labels in train_dataloader:
-
-            current_images = current_images.to(DEVICE)
-            goal_image = goal_image.to(DEVICE)
-            labels = labels.to(DEVICE)
-
-            optimizer.zero_grad()
-            output = model(current_images, goal_image)
-            loss = loss_fn(output, labels) * LOSS_SCALE
-
-            loss.backward()
-            optimizer.step()
-            running_loss += loss.item()
-
-            torch.cuda.empty_cache()
-
-        training_loss = running_loss / len(train_dataloader)
+        training_loss = train_one_epoch(model, train_dataloader, optimizer, step_loss, log_interval=LOG_INTERVAL)
 
         # Moving Average
         training_total_loss += training_loss * 5
@@ -143,40 +179,40 @@ if __name__ == '__main__':
 
         if ((epoch + 1) % WEIGHT_SAVING_STEP) == 0:
             weight_save_path = os.path.join(WEIGHT_PATH, 'epoch_' + str(epoch + 1) + '.pth')
-            # When using DataParallel, save the model.module's state dict
-            torch.save(model.state_dict(), weight_save_path)
+            torch.save(base_model.state_dict(), weight_save_path)
             print('Save Weights', end='; ')
 
         # Valid Model
         model.eval()
         with torch.no_grad():
 
-            num_correct, num_total = 0, 0
-            for current_images, goal_image, labels in train_dataloader:
+            train_metrics.reset()
+            for current_images, goal_image, labels, goal_inverse_index in train_dataloader:
 
-                current_images = current_images.to(DEVICE)
-                goal_image = goal_image.to(DEVICE)
+                current_images = batch_normalize(current_images.to(DEVICE))
+                goal_image = batch_normalize(goal_image.to(DEVICE))
                 labels = labels.to(DEVICE)
-
-                output = model(current_images, goal_image)
-                for i in range(output.shape[0]):
-                    loss = 0
-                    for j in range(output.shape[1]):
-                        loss += abs(output[i][j] - labels[i][j]).item()
-                    num_total += 1
-                    if loss < TOLERANCE:
-                        num_correct += 1
-            train_accuracy = (num_correct / num_total) * 100
+                goal_inverse_index = goal_inverse_index.to(DEVICE)
+                # DataParallel scatters samples, so it gets one goal per sample and its goal id, every replica
+                # then encodes the distinct goals of its samples once
+                goal_ids = None
+                if isinstance(model, torch.nn.DataParallel):
+                    goal_image, goal_ids, goal_inverse_index = goal_image[goal_inverse_index], goal_inverse_index, None
+
+                output = model(current_images, goal_image, goal_inverse_index, goal_ids)
+                train_metrics.update(output, labels)
+            train_results = train_metrics.compute()
+            train_accuracy = train_results['accuracy']
 
             accuracies.append(train_accuracy)
-            print(f'Train Accuracy {accuracies[epoch]:.2f}%')
+            print(f'Train Accuracy {accuracies[epoch]:.2f}%, MAE: {", ".join(f"{mae:.4f}" for mae in train_results["mae"])}')
             np.save(accuracies_path, accuracies)
 
     print('Finished Training !')
 
     # Save last weight
     weight_save_path = os.path.join(WEIGHT_PATH, 'epoch_' + str(epoch + 1) + '.pth')
-    torch.save(model.state_dict(), weight_save_path)
+    torch.save(base_model.state_dict(), weight_save_path)
     print('Save Last Weights')
 
     # Plot Training Loss and Accuracies graphs
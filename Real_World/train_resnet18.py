@@ -3,22 +3,34 @@ import numpy as np
 from torchvision import transforms
 from torch.utils.data import DataLoader
 from SPOT_SingleStep_DataLoader import SPOT_SingleStep_DataLoader
+from SPOT_SingleStep_Shard_DataLoader import SPOT_SingleStep_Shard_DataLoader
+from trajectory_sampler import TrajectoryChunkBatchSampler
+from batch_transforms import uint8_transforms, BatchNormalize
+from shared_image_cache import SharedImageCache
 from models.Resnet18MLP5 import SharedResNet18MLP5
+from metrics import ToleranceAccuracy
+from training_loop import train_one_epoch
 from plot_graph import plot_graph
 
 CONTINUE = 0   # Start fresh at 0
+UINT8_TRANSPORT = True   # Workers return uint8 images, normalised per batch on the device
+IMAGE_CACHE_GB = 0   # Decoded images kept in shared memory across epochs, needs UINT8_TRANSPORT, 0 disables
+USE_IMAGE_SHARDS = False   # Read pre-decoded images written by build_image_shards.py
 
 # Setup Destination
 MODEL_NAME = 'ResNet18MLP5'
 DATASET_NAMES = ['map01_01a', 'map01_01b', 'map01_02a', 'map01_02b', 'map01_03a', 'map01_03b']
 DATASET_DIR = '/data/lee04484/SPOT_Real_World_Dataset/cleanup_dataset/'
+IMAGE_SHARD_DIR = '/data/lee04484/SPOT_Real_World_Dataset/image_shards/'
 
 # Hyper Parameters
 BATCH_SIZE = 128
 LEARNING_RATE = 1e-4
+TRAJECTORY_CHUNK_SIZE = 8   # Consecutive steps of a trajectory per batch chunk, 1 is a full shuffle
 
 # Training Parameters
 WEIGHT_SAVING_STEP = 20
+LOG_INTERVAL = 0   # Steps between loss prints within an epoch, 0 for none. Each print waits for the device
 LOSS_SCALE = 1e3
 
 # Validation Parameter
@@ -42,6 +54,9 @@ data_transforms = transforms.Compose([
     transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])
 ])
 
+# Image shards are already resized and converted to tensors
+shard_transforms = transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])
+
 if __name__ == '__main__':
 
     # Setup Dataset Path
@@ -100,35 +115,50 @@ if __name__ == '__main__':
         accuracies_path = os.path.join(FIGURE_PATH, 'new_accuracies.npy')
         print('Parameter Loaded!')
 
-    train_dataset = SPOT_SingleStep_DataLoader(
-            dataset_dirs = DATASET_PATHS,
-            transform = data_transforms
-        )
-    train_dataloader = DataLoader(train_dataset, batch_size=BATCH_SIZE, shuffle=True, num_workers=8, pin_memory=True)
+    if USE_IMAGE_SHARDS:
+        train_dataset = SPOT_SingleStep_Shard_DataLoader(
+                shard_dirs = [os.path.join(IMAGE_SHARD_DIR, dataset_name) for dataset_name in DATASET_NAMES],
+                transform = None if UINT8_TRANSPORT else shard_transforms,
+                uint8 = UINT8_TRANSPORT,
+                return_goal_index = True
+            )
+    else:
+        train_dataset = SPOT_SingleStep_DataLoader(
+                dataset_dirs = DATASET_PATHS,
+                transform = uint8_transforms if UINT8_TRANSPORT else data_transforms,
+                return_goal_index = True
+            )
+    if IMAGE_CACHE_GB > 0 and not USE_IMAGE_SHARDS:
+        if not UINT8_TRANSPORT:
+            raise ValueError('IMAGE_CACHE_GB needs UINT8_TRANSPORT, the cache holds uint8 images')
+        train_dataset.image_cache = SharedImageCache(len(train_dataset), (5, 3, 224, 224), int(IMAGE_CACHE_GB * 2**30))
+    batch_normalize = BatchNormalize().to(DEVICE)
+    train_sampler = TrajectoryChunkBatchSampler(train_dataset.goal_indices, BATCH_SIZE, chunk_size=TRAJECTORY_CHUNK_SIZE)
+    # Goal table built once before the workers start, they share it instead of each decoding every goal every epoch
+    train_dataset.goal_table()
+    train_dataloader = DataLoader(train_dataset, batch_sampler=train_sampler, num_workers=8, pin_memory=True,
+                                  collate_fn=train_dataset.collate_fn)
+
+    # Accumulated on the device, read back once per epoch
+    train_metrics = ToleranceAccuracy(TOLERANCE, device=DEVICE)
+
+    def step_loss(batch):
+        # Loss of one training batch, on the device
+        current_images, goal_image, labels = batch
+
+        current_images = batch_normalize(current_images.to(DEVICE))
+        goal_image = batch_normalize(goal_image.to(DEVICE))
+        labels = labels.to(DEVICE)
+
+        output = model(current_images, goal_image)
+        loss = loss_fn(output, labels) * LOSS_SCALE
+        return loss
 
     # Train Model
     for epoch in range(CONTINUE, 1000):
+        train_sampler.set_epoch(epoch)
         
-        model.train()
-        running_loss = 0.0
-        
-        for current_images, goal_image, labels in train_dataloader:
-
-            current_images = current_images.to(DEVICE)
-            goal_image = goal_image.to(DEVICE)
-            labels = labels.to(DEVICE)
-            
-            optimizer.zero_grad()
-            output = model(current_images, goal_image)
-            loss = loss_fn(output, labels) * LOSS_SCALE
-
-            loss.backward()
-            optimizer.step()
-            running_loss += loss.item()
-
-            torch.cuda.empty_cache()
-
-        training_loss = running_loss / len(train_dataloader)
+        training_loss = train_one_epoch(model, train_dataloader, optimizer, step_loss, log_interval=LOG_INTERVAL)
 
         # Moving Average
         training_total_loss += training_loss * 5
@@ -149,25 +179,20 @@ if __name__ == '__main__':
         model.eval()
         with torch.no_grad():
 
-            num_correct, num_total = 0, 0
+            train_metrics.reset()
             for current_images, goal_image, labels in train_dataloader:
 
-                current_images = current_images.to(DEVICE)
-                goal_image = goal_image.to(DEVICE)
+                current_images = batch_normalize(current_images.to(DEVICE))
+                goal_image = batch_normalize(goal_image.to(DEVICE))
                 labels = labels.to(DEVICE)
 
                 output = model(current_images, goal_image)
-                for i in range(output.shape[0]):
-                    loss = 0
-                    for j in range(output.shape[1]):
-                        loss += abs(output[i][j] - labels[i][j]).item()
-                    num_total += 1
-                    if loss < TOLERANCE:
-                        num_correct += 1
-            train_accuracy = (num_correct / num_total) * 100
+                train_metrics.update(output, labels)
+            train_results = train_metrics.compute()
+            train_accuracy = train_results['accuracy']
 
             accuracies.append(train_accuracy)
-            print(f'Train Accuracy {accuracies[epoch]:.2f}%')
+            print(f'Train Accuracy {accuracies[epoch]:.2f}%, MAE: {", ".join(f"{mae:.4f}" for mae in train_results["mae"])}')
             np.save(accuracies_path, accuracies)
 
     print('Finished Training !')
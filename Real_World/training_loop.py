@@ -0,0 +1,45 @@
+import torch
+
+class RunningMean:
+    # Mean of scalar tensors, summed in float64 on their device and only copied to the host by compute()
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.total = None
+        self.count = 0
+
+    def update(self, value):
+        value = value.detach()
+        if self.total is None:
+            self.total = value.to(dtype=torch.float64, copy=True)
+        else:
+            self.total.add_(value)
+        self.count += 1
+
+    def compute(self):
+        if self.total is None:
+            return 0.0
+        return self.total.item() / self.count
+
+def train_one_epoch(model, dataloader, optimizer, step_loss, log_interval=0):
+    # One pass over dataloader, returns the mean loss. step_loss(batch) returns the scalar loss of a batch,
+    # the loop only waits on the device to print every log_interval steps (0 never) and at the end
+    model.train()
+    epoch_loss = RunningMean()
+    interval_loss = RunningMean()
+
+    for step, batch in enumerate(dataloader, 1):
+        optimizer.zero_grad()
+        loss = step_loss(batch)
+        loss.backward()
+        optimizer.step()
+
+        epoch_loss.update(loss)
+        if log_interval:
+            interval_loss.update(loss)
+            if step % log_interval == 0:
+                print(f'Step {step}/{len(dataloader)}, Loss: {interval_loss.compute():.6f}')
+                interval_loss.reset()
+
+    return epoch_loss.compute()
@@ -0,0 +1,52 @@
+import numpy as np
+import torch
+from torch.utils.data import Sampler
+
+class TrajectoryChunkBatchSampler(Sampler):
+    # Batches of shuffled chunks of chunk_size consecutive trajectory steps, chunk_size=1 is a plain shuffle
+    def __init__(self, goal_indices, batch_size, chunk_size=8, drop_last=False, seed=0):
+        # goal_indices: goal of every sample of the dataset. Samples of one trajectory
+        # share a goal and are contiguous, so trajectories are the runs of equal values.
+        goal_indices = np.asarray(goal_indices)
+        self.num_samples = len(goal_indices)
+        self.trajectory_starts = np.flatnonzero(np.diff(goal_indices, prepend=-1))
+        self.trajectory_ends = np.append(self.trajectory_starts[1:], self.num_samples)
+
+        self.batch_size = batch_size
+        self.chunk_size = chunk_size
+        self.drop_last = drop_last
+        self.seed = seed
+        self.epoch = 0
+
+    def set_epoch(self, epoch):
+        # Without it, every pass over the sampler moves on to the next epoch's order
+        self.epoch = epoch
+
+    def __len__(self):
+        if self.drop_last:
+            return self.num_samples // self.batch_size
+        return (self.num_samples + self.batch_size - 1) // self.batch_size
+
+    def chunks(self, generator):
+        # (start, end) sample ranges of every chunk, chunk boundaries shifted by a random offset per trajectory
+        chunks = []
+        offsets = torch.randint(self.chunk_size, (len(self.trajectory_starts),), generator=generator).tolist()
+        for start, end, offset in zip(self.trajectory_starts.tolist(), self.trajectory_ends.tolist(), offsets):
+            boundaries = [start] + list(range(start + offset, end, self.chunk_size))[offset == 0:] + [end]
+            chunks.extend(zip(boundaries[:-1], boundaries[1:]))
+        return chunks
+
+    def __iter__(self):
+        generator = torch.Generator()
+        generator.manual_seed(self.seed + self.epoch)
+        self.epoch += 1
+
+        chunks = self.chunks(generator)
+        order = torch.randperm(len(chunks), generator=generator).tolist()
+        indices = np.concatenate([np.arange(*chunks[chunk_idx]) for chunk_idx in order])
+
+        for batch_start in range(0, self.num_samples, self.batch_size):
+            batch = indices[batch_start:batch_start + self.batch_size]
+            if len(batch) < self.batch_size and self.drop_last:
+                break
+            yield batch.tolist()
@@ -1,10 +1,13 @@
 import torch
 import torch.nn as nn
 from torchvision.models import resnet18
+from module_ensemble import ModuleEnsemble, flatten_ensemble_state_dict
 
 class FiveResNet18MLP5(nn.Module):
-    def __init__(self):
+    def __init__(self, vectorized=False):
         super(FiveResNet18MLP5, self).__init__()
+        # Run the ten ResNets as one vmapped ModuleEnsemble rather than one after another
+        self.vectorized = vectorized
 
         # Current Images Set
         # ResNet1
@@ -54,9 +57,36 @@ class FiveResNet18MLP5(nn.Module):
             nn.Linear(1024, 1024),
             nn.ReLU())
         self.fc_layer5 = nn.Linear(1024, 1)
+
+        if vectorized:
+            # Same state_dict keys as the separate ResNets, checkpoints load in either mode
+            names = [f'current_resnet{i}' for i in range(1, 6)] + [f'goal_resnet{i}' for i in range(1, 6)]
+            self.resnets = ModuleEnsemble([self._modules.pop(name) for name in names], names)
+            flatten_ensemble_state_dict(self, 'resnets')
     
     def forward(self, current_images, goal_images):
+        # goal_images: (B, 5, 3, H, W), or (1, 5, 3, H, W) when every sample shares one goal.
+        # A single goal stack is encoded once and its embedding broadcast over the batch, the
+        # goal ResNets then get the summed gradient of all samples, as with B identical copies
+        
+        if self.vectorized:
+            current_features, goal_features = self.vectorized_features(current_images, goal_images)
+        else:
+            current_features, goal_features = self.sequential_features(current_images, goal_images)
+        goal_features = goal_features.expand(current_features.size(0), -1)
+        features = torch.cat([current_features, goal_features], dim=1)
+
+        # Forward pass through the fully connected layers
+        output1 = self.fc_layer1(features)
+        output2 = self.fc_layer2(output1)
+        output3 = self.fc_layer3(output2)
+        output4 = self.fc_layer4(output3)
+        output = self.fc_layer5(output4)
         
+        return output
+
+    def sequential_features(self, current_images, goal_images):
+
         # Forward pass through ResNet
         current_embedding1 = self.current_resnet1(current_images[:, 0, :, :])
         current_embedding1 = torch.flatten(current_embedding1, start_dim=1)
@@ -84,13 +114,24 @@ class FiveResNet18MLP5(nn.Module):
         # Concatenate the features
         current_features = torch.cat((current_embedding1, current_embedding2, current_embedding3, current_embedding4, current_embedding5), dim=1)
         goal_features = torch.cat((goal_embedding1, goal_embedding2, goal_embedding3, goal_embedding4, goal_embedding5), dim=1)
-        features = torch.cat([current_features, goal_features], dim=1)
 
-        # Forward pass through the fully connected layers
-        output1 = self.fc_layer1(features)
-        output2 = self.fc_layer2(output1)
-        output3 = self.fc_layer3(output2)
-        output4 = self.fc_layer4(output3)
-        output = self.fc_layer5(output4)
-        
-        return output
\ No newline at end of file
+        return current_features, goal_features
+
+    def vectorized_features(self, current_images, goal_images):
+        # Images camera-major, (5, B, 3, H, W), embeddings (5, B, 512, 1, 1)
+        current_images = current_images.transpose(0, 1)
+        goal_images = goal_images.transpose(0, 1)
+        if current_images.shape == goal_images.shape:
+            # All ten ResNets in one call
+            embeddings = self.resnets(torch.cat([current_images, goal_images], dim=0))
+            current_embeddings, goal_embeddings = embeddings[:5], embeddings[5:]
+        else:
+            # A shared (1, 5, 3, H, W) goal stack, the current and goal ResNets run on their own batch sizes
+            current_embeddings = self.resnets(current_images, members=slice(0, 5))
+            goal_embeddings = self.resnets(goal_images, members=slice(5, 10))
+
+        # (B, 5 * 512), cameras in order as in sequential_features
+        current_features = current_embeddings.flatten(start_dim=2).transpose(0, 1).flatten(start_dim=1)
+        goal_features = goal_embeddings.flatten(start_dim=2).transpose(0, 1).flatten(start_dim=1)
+
+        return current_features, goal_features
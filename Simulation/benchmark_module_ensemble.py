@@ -0,0 +1,50 @@
+import time
+import torch
+from FiveResNet18MLP5_7 import FiveResNet18MLP5_7
+
+# Forward + backward step time of FiveResNet18MLP5_7 with the ten ResNets run one after
+# another against one vmapped ModuleEnsemble call, on the CPU. Also checks that both modes
+# share state_dict keys, give the same outputs and gradients, and update BatchNorm alike.
+
+BATCH_SIZE = 8
+IMAGE_SIZE = 224
+NUM_STEPS = 5
+
+def step(model, current_images, goal_images):
+    model.zero_grad()
+    output = model(current_images, goal_images)
+    output.square().sum().backward()
+    return output.detach()
+
+def step_time(model, current_images, goal_images):
+    step(model, current_images, goal_images)
+    start = time.perf_counter()
+    for _ in range(NUM_STEPS):
+        step(model, current_images, goal_images)
+    return (time.perf_counter() - start) / NUM_STEPS
+
+if __name__ == '__main__':
+    torch.manual_seed(0)
+    sequential = FiveResNet18MLP5_7()
+    vectorized = FiveResNet18MLP5_7(vectorized=True)
+    assert sorted(sequential.state_dict()) == sorted(vectorized.state_dict())
+    vectorized.load_state_dict(sequential.state_dict())
+
+    current_images = torch.randn(BATCH_SIZE, 5, 3, IMAGE_SIZE, IMAGE_SIZE)
+    for goal_batch in [BATCH_SIZE, 1]:
+        goal_images = torch.randn(goal_batch, 5, 3, IMAGE_SIZE, IMAGE_SIZE)
+        sequential_output = step(sequential, current_images, goal_images)
+        vectorized_output = step(vectorized, current_images, goal_images)
+        assert torch.allclose(sequential_output, vectorized_output, atol=1e-4), (sequential_output - vectorized_output).abs().max()
+
+        grad = sequential.goal_resnet3[0].weight.grad
+        vectorized_grad = getattr(vectorized.resnets, '0_weight').grad[7]
+        assert torch.allclose(grad, vectorized_grad, atol=1e-4), (grad - vectorized_grad).abs().max()
+
+        sequential_state, vectorized_state = sequential.state_dict(), vectorized.state_dict()
+        for key in sequential_state:
+            assert torch.allclose(sequential_state[key].float(), vectorized_state[key].float(), atol=1e-4), key
+        print(f'Goal batch {goal_batch}: outputs, gradients and BatchNorm statistics match')
+
+        print(f'Goal batch {goal_batch}: sequential {step_time(sequential, current_images, goal_images) * 1e3:.0f} ms/step, '
+              f'vectorized {step_time(vectorized, current_images, goal_images) * 1e3:.0f} ms/step')
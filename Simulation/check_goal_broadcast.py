@@ -0,0 +1,32 @@
+import torch
+from FiveResNet18MLP5_7 import FiveResNet18MLP5_7
+
+# Checks that a single (1, 5, 3, H, W) goal stack gives the same outputs and goal ResNet
+# gradients as the same stack repeated over the batch, in train and eval mode.
+
+BATCH_SIZE = 4
+IMAGE_SIZE = 64
+
+def outputs_and_grads(model, current_images, goal_images):
+    model.zero_grad()
+    output = model(current_images, goal_images)
+    output.square().sum().backward()
+    return output.detach(), [param.grad.clone() for param in model.goal_resnet1.parameters()]
+
+if __name__ == '__main__':
+    torch.manual_seed(0)
+    model = FiveResNet18MLP5_7().double()
+    current_images = torch.randn(BATCH_SIZE, 5, 3, IMAGE_SIZE, IMAGE_SIZE, dtype=torch.float64)
+    goal_stack = torch.randn(1, 5, 3, IMAGE_SIZE, IMAGE_SIZE, dtype=torch.float64)
+
+    for train in [True, False]:
+        model.train(train)
+        state = {name: buffer.clone() for name, buffer in model.named_buffers()}
+        repeated_output, repeated_grads = outputs_and_grads(model, current_images, goal_stack.expand(BATCH_SIZE, -1, -1, -1, -1))
+        model.load_state_dict(state, strict=False)
+        output, grads = outputs_and_grads(model, current_images, goal_stack)
+
+        assert torch.allclose(output, repeated_output, atol=1e-8), (output - repeated_output).abs().max()
+        for grad, repeated_grad in zip(grads, repeated_grads):
+            assert torch.allclose(grad, repeated_grad, atol=1e-8), (grad - repeated_grad).abs().max()
+        print(f'{"train" if train else "eval"} mode: outputs and goal gradients match')
@@ -0,0 +1,78 @@
+import copy
+import torch
+import torch.nn as nn
+from torch.func import stack_module_state, functional_call, vmap
+
+class ModuleEnsemble(nn.Module):
+    # Modules of one architecture stacked and run as a single vmapped call,
+    # state_dict keys stay those of the separate modules ('<name>.<key>')
+    def __init__(self, modules, names):
+        super(ModuleEnsemble, self).__init__()
+        self.names = list(names)
+
+        params, buffers = stack_module_state(modules)
+        # Attribute of every stacked tensor, keyed by its name in the member modules
+        self.param_attrs = {key: key.replace('.', '_') for key in params}
+        self.buffer_attrs = {key: key.replace('.', '_') for key in buffers}
+        for key, attr in self.param_attrs.items():
+            self.register_parameter(attr, nn.Parameter(params[key].detach()))
+        for key, attr in self.buffer_attrs.items():
+            self.register_buffer(attr, buffers[key])
+
+        # Architecture only, not a submodule so .to() and state_dict skip it
+        object.__setattr__(self, 'base', copy.deepcopy(modules[0]).to('meta'))
+
+    def forward(self, x, members=slice(None)):
+        # x: (M, B, ...) input of every member, members selects M of them
+        self.base.train(self.training)
+        params = {key: getattr(self, attr)[members] for key, attr in self.param_attrs.items()}
+        buffers = {key: getattr(self, attr)[members] for key, attr in self.buffer_attrs.items()}
+
+        def call(params, buffers, x):
+            return functional_call(self.base, (params, buffers), (x,))
+
+        return vmap(call)(params, buffers, x)
+
+    def _stacked_state(self):
+        return [(key, getattr(self, attr)) for key, attr in list(self.param_attrs.items()) + list(self.buffer_attrs.items())]
+
+    def _save_to_state_dict(self, destination, prefix, keep_vars):
+        for key, stacked in self._stacked_state():
+            for name, tensor in zip(self.names, stacked):
+                destination[f'{prefix}{name}.{key}'] = tensor if keep_vars else tensor.detach()
+
+    def _load_from_state_dict(self, state_dict, prefix, local_metadata, strict, missing_keys, unexpected_keys, error_msgs):
+        expected_keys = set()
+        for key, stacked in self._stacked_state():
+            for member, name in enumerate(self.names):
+                state_key = f'{prefix}{name}.{key}'
+                expected_keys.add(state_key)
+                if state_key not in state_dict:
+                    missing_keys.append(state_key)
+                    continue
+                value = state_dict[state_key]
+                if value.shape != stacked.shape[1:]:
+                    error_msgs.append(f'size mismatch for {state_key}: copying a param with shape {value.shape}, '
+                                      f'the shape in current model is {stacked.shape[1:]}.')
+                    continue
+                with torch.no_grad():
+                    stacked[member].copy_(value)
+        if strict:
+            unexpected_keys.extend(key for key in state_dict if key.startswith(prefix) and key not in expected_keys)
+
+def flatten_ensemble_state_dict(module, attribute):
+    # Keys of the ModuleEnsemble module.<attribute> as if its members were attributes of module,
+    # e.g. 'current_resnet1.0.weight' in place of '<attribute>.current_resnet1.0.weight'
+    ensemble_prefix = attribute + '.'
+
+    def save_hook(module, state_dict, prefix, local_metadata):
+        for key in [key for key in state_dict if key.startswith(prefix + ensemble_prefix)]:
+            state_dict[prefix + key[len(prefix + ensemble_prefix):]] = state_dict.pop(key)
+
+    def load_pre_hook(state_dict, prefix, *args):
+        names = getattr(module, attribute).names
+        for key in [key for key in state_dict if key.startswith(prefix) and key[len(prefix):].split('.', 1)[0] in names]:
+            state_dict[prefix + ensemble_prefix + key[len(prefix):]] = state_dict.pop(key)
+
+    module._register_state_dict_hook(save_hook)
+    module._register_load_state_dict_pre_hook(load_pre_hook)
@@ -33,12 +33,14 @@ def test_model(test_dataset, model, weight_name, device='cuda', draw=False, show
     model.load_state_dict(torch.load(WEIGHT_PATH + weight_name))
     model.eval()
 
-    test_dataloader = DataLoader(test_dataset, batch_size=1)
+    test_dataloader = DataLoader(test_dataset, batch_size=1, num_workers=4)
     results = np.empty([0, 14])
+    goal_images = test_dataset.goal_images.unsqueeze(0).to(device)
 
     with torch.no_grad():
         idx = 0
-        for current_images, goal_images, label in test_dataloader:
+        for current_images, label in test_dataloader:
+            current_images = current_images.to(device)
             output = model(current_images, goal_images)
             # output_degree = (output.item() / np.pi) * 180
             # label_degree = (label.item() / np.pi) * 180
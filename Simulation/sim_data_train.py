@@ -3,6 +3,7 @@ import torch, os
 from torchvision import transforms
 from spotdatasetloader import SPOTDataLoader
 from FiveResNet18MLP5_7 import FiveResNet18MLP5_7
+from Real_World.metrics import ToleranceAccuracy
 from Simulation.plot_graph import plot_graph
 import numpy as np
 from sklearn.model_selection import KFold
@@ -59,6 +60,8 @@ else:
 loss_fn = torch.nn.MSELoss()
 BATCH_SIZE = 16
 LEARNING_RATE = 1e-6
+NUM_WORKERS = 8   # PNG decoding runs in DataLoader workers
+VECTORIZED_RESNETS = True   # Run the ten ResNets as one vmapped call, same checkpoints either way
 
 # Training Parameters
 WEIGHT_SAVING_STEP = 50
@@ -67,6 +70,9 @@ LOSS_SCALE = 1e3
 # Validation Parameter
 TOLERANCE = 1e-4
 
+# Every sample shares the goal_folder stack, (1, 5, 3, H, W) on the device for the whole run, the model broadcasts it
+goal_images = train_dataset.goal_images.unsqueeze(0).to(DEVICE)
+
 # Saving Hyper Param
 hyper_params_path = WEIGHT_PATH + 'hyper_params'
 hyper_params = {'NUM_FOLD': NUM_FOLD, 'BATCH_SIZE': BATCH_SIZE, 'LEARNING_RATE': LEARNING_RATE, 'LOSS_SCALE': LOSS_SCALE, 'TOLERANCE': TOLERANCE}
@@ -79,8 +85,10 @@ for fold, (train_ids, valid_ids) in enumerate(k_fold.split(train_dataset)):
         os.mkdir(fold_path)
 
     # Setup Model
-    model = FiveResNet18MLP5_7().to(DEVICE)
+    model = FiveResNet18MLP5_7(vectorized=VECTORIZED_RESNETS).to(DEVICE)
     optimizer = torch.optim.Adam(model.parameters(), lr=LEARNING_RATE)
+    # Accumulated on the device, read back once per pass
+    accuracy_metric = ToleranceAccuracy(TOLERANCE, num_axes=7, device=DEVICE)
 
     # Tracking Parameters
     epoch = CONTINUE[fold] + 1
@@ -101,16 +109,21 @@ for fold, (train_ids, valid_ids) in enumerate(k_fold.split(train_dataset)):
     train_subsampler = torch.utils.data.SubsetRandomSampler(train_ids)
     valid_subsampler = torch.utils.data.SubsetRandomSampler(valid_ids)
 
-    train_dataloader = DataLoader(train_dataset, batch_size=BATCH_SIZE, sampler=train_subsampler)
-    valid_dataloader = DataLoader(train_dataset, batch_size=BATCH_SIZE, sampler=valid_subsampler)
+    train_dataloader = DataLoader(train_dataset, batch_size=BATCH_SIZE, sampler=train_subsampler, num_workers=NUM_WORKERS,
+                                  pin_memory=(DEVICE == 'cuda'), persistent_workers=True)
+    valid_dataloader = DataLoader(train_dataset, batch_size=BATCH_SIZE, sampler=valid_subsampler, num_workers=NUM_WORKERS,
+                                  pin_memory=(DEVICE == 'cuda'), persistent_workers=True)
 
     # Train Model
     model.train()
     while training_loss > ((TOLERANCE ** 2) * LOSS_SCALE):
         
-        running_loss = 0.0
+        # Summed on the device, read back once per epoch
+        running_loss = torch.zeros((), dtype=torch.float64, device=DEVICE)
         
-        for current_images, goal_images, labels in train_dataloader:
+        for current_images, labels in train_dataloader:
+            current_images = current_images.to(DEVICE, non_blocking=True)
+            labels = labels.to(DEVICE, non_blocking=True)
             
             optimizer.zero_grad()
             output = model(current_images, goal_images)
@@ -118,9 +131,9 @@ for fold, (train_ids, valid_ids) in enumerate(k_fold.split(train_dataset)):
 
             loss.backward()
             optimizer.step()
-            running_loss += loss.item()
+            running_loss += loss.detach()
     
-        training_loss = running_loss / len(train_dataloader)
+        training_loss = running_loss.item() / len(train_dataloader)
 
         # Moving Average
         training_total_loss += training_loss * 5
@@ -140,29 +153,21 @@ for fold, (train_ids, valid_ids) in enumerate(k_fold.split(train_dataset)):
         model.eval()
         with torch.no_grad():
 
-            num_correct, num_total = 0, 0
-            for current_images, goal_images, labels in train_dataloader:
+            accuracy_metric.reset()
+            for current_images, labels in train_dataloader:
+                current_images = current_images.to(DEVICE, non_blocking=True)
+                labels = labels.to(DEVICE, non_blocking=True)
                 output = model(current_images, goal_images)
-                for i in range(len(output)):
-                    loss = 0
-                    for j in range(7):
-                        loss += abs(output[i][j] - labels[i][j]).item()
-                    num_total += 1
-                    if loss < TOLERANCE:
-                        num_correct += 1
-            train_accuracy = (num_correct / num_total) * 100
-
-            num_correct, num_total = 0, 0
-            for current_images, goal_images, labels in valid_dataloader:
+                accuracy_metric.update(output, labels)
+            train_accuracy = accuracy_metric.compute()['accuracy']
+
+            accuracy_metric.reset()
+            for current_images, labels in valid_dataloader:
+                current_images = current_images.to(DEVICE, non_blocking=True)
+                labels = labels.to(DEVICE, non_blocking=True)
                 output = model(current_images, goal_images)
-                for i in range(len(output)):
-                    loss = 0
-                    for j in range(7):
-                        loss += abs(output[i][j] - labels[i][j]).item()
-                    num_total += 1
-                    if loss < TOLERANCE:
-                        num_correct += 1
-            valid_accuracy = (num_correct / num_total) * 100
+                accuracy_metric.update(output, labels)
+            valid_accuracy = accuracy_metric.compute()['accuracy']
 
             accuracies.append([train_accuracy, valid_accuracy])
             print(f'Train Accuracy {accuracies[epoch - 1][0]:.2f}%, Valid Accuracy: {accuracies[epoch - 1][1]:.2f}%')
@@ -14,50 +14,32 @@ from PIL import Image
 import numpy as np
 
 class SPOTDataLoader(Dataset):
+    # Tensors stay on the CPU so DataLoader workers can decode in parallel, move batches to the device in the training loop
     def __init__(self, root_dir, goal_folder, labels_file, transform=None):
         self.root_dir = root_dir
         self.goal_folder = goal_folder
         self.transform = transform
         self.labels = np.load(labels_file).astype(np.float32)
 
-        if torch.cuda.is_available():
-            self.cuda = True
-        else:
-            self.cuda = False
+        # Every sample has the same goal, its 5 images are decoded once and not returned per sample.
+        # Move goal_images to the device once and pass it to the model for every batch
+        goal_folder_path = os.path.join(self.root_dir, self.goal_folder)
+        self.goal_images = torch.stack([self.load_image(os.path.join(goal_folder_path, f"{i}.png")) for i in range(5)], dim=0)
 
     def __len__(self):
         return self.labels.shape[0]
 
+    def load_image(self, image_path):
+        image = Image.open(image_path).convert('RGB')
+        if self.transform:
+            image = self.transform(image)
+        return image
+
     def __getitem__(self, idx):
         folder_name = format(idx, '05d')
         folder_path = os.path.join(self.root_dir, folder_name)
 
-        input_images = []
-        for i in range(5):
-            input_image_path = os.path.join(folder_path, f"{i}.png")
-            image = Image.open(input_image_path).convert('RGB')
-            if self.transform:
-                image = self.transform(image)
-            input_images.append(image)
+        input_images = torch.stack([self.load_image(os.path.join(folder_path, f"{i}.png")) for i in range(5)], dim=0)
+        label_tensor = torch.from_numpy(self.labels[idx])
 
-        goal_images = []
-        goal_folder_path = os.path.join(self.root_dir, self.goal_folder)
-        for i in range(5):
-            goal_image_path = os.path.join(goal_folder_path, f"{i}.png")
-            image = Image.open(goal_image_path).convert('RGB')
-            if self.transform:
-                image = self.transform(image)
-            goal_images.append(image)
-
-        label = self.labels[idx]
-
-        if self.cuda is True:
-            input_images = torch.stack(input_images, dim=0).cuda()
-            goal_images = torch.stack(goal_images, dim=0).cuda()
-            label_tensor = torch.tensor(label).cuda()
-        else:
-            input_images = torch.stack(input_images, dim=0)
-            goal_images = torch.stack(goal_images, dim=0)
-            label_tensor = torch.tensor(label)
-
-        return input_images, goal_images, label_tensor
\ No newline at end of file
+        return input_images, label_tensor